@@ -10,17 +10,7 @@ warnings.simplefilter(action='ignore', category=FutureWarning)
 conversion_GWh2McM = 0.09999
 split_country_list = ['Belgium','Germany','France','Hungary','Italy','Luxembourg','Poland','Portugal','United Kingdom','Netherlands']
 
-def get_European_balance():
-    sql_params = {
-        "server_name": "ekofisk",
-        "database_name": "LNGTrade",
-        "table_name": "tblEuropeanMonthlyBalance",
-        "schema_name": "LNGG",
-    }
-
-    sql_obj = MySqlConnection(sql_params["server_name"], sql_params["database_name"])
-
-    query_europe_production = '''
+query_European_balance = '''
     SELECT  [Date]
       ,[Storage]
       ,[Storage_FC_normal]
@@ -41,22 +31,7 @@ def get_European_balance():
 
     '''
 
-    df = sql_obj.sql_to_df(query_europe_production)
-    df['Date'] = pd.to_datetime(df['Date'])
-
-    return df
-
-def get_European_demand_by_sector():
-    sql_params = {
-        "server_name": "ekofisk",
-        "database_name": "LNGTrade",
-        "table_name": "tblEuropeanMonthlyBalance",
-        "schema_name": "LNGG",
-    }
-
-    sql_obj = MySqlConnection(sql_params["server_name"], sql_params["database_name"])
-
-    query = '''
+query_European_demand_by_sector = '''
     SELECT [Date]
       ,[Country]
       ,[Demand Sector Category]
@@ -69,13 +44,66 @@ def get_European_demand_by_sector():
     order by timestamp desc
       '''
 
-    df = sql_obj.sql_to_df(query)
+# Both queries read the latest vintage only, so their result changes with max(timestamp)
+validation_European_balance = "select max(timestamp) FROM [LNGTrade].[LNGG].[tblEuropeanMonthlyBalance]"
+validation_European_demand_by_sector = "select max(timestamp) FROM [LNGTrade].[dbo].[ZL_EuropeDemandMonthly]"
+
+
+def get_European_balance():
+    sql_params = {
+        "server_name": "ekofisk",
+        "database_name": "LNGTrade",
+        "table_name": "tblEuropeanMonthlyBalance",
+        "schema_name": "LNGG",
+    }
+
+    with MySqlConnection(sql_params["server_name"], sql_params["database_name"]) as sql_obj:
+        df = sql_obj.sql_to_df_cached(
+            query_European_balance,
+            validation_query=validation_European_balance,
+        )
     df['Date'] = pd.to_datetime(df['Date'])
 
     return df
 
+def get_European_demand_by_sector():
+    sql_params = {
+        "server_name": "ekofisk",
+        "database_name": "LNGTrade",
+        "table_name": "tblEuropeanMonthlyBalance",
+        "schema_name": "LNGG",
+    }
+
+    with MySqlConnection(sql_params["server_name"], sql_params["database_name"]) as sql_obj:
+        df = sql_obj.sql_to_df_cached(
+            query_European_demand_by_sector,
+            validation_query=validation_European_demand_by_sector,
+        )
+    df['Date'] = pd.to_datetime(df['Date'])
+
+    return df
+
+
+def get_European_data():
+    """Loads the balance and the demand by sector concurrently, on pooled connections."""
+    with MySqlConnection("ekofisk", "LNGTrade") as sql_obj:
+        dfs = sql_obj.sql_to_dfs(
+            {
+                "balance": query_European_balance,
+                "demand_by_sector": query_European_demand_by_sector,
+            },
+            validation_queries={
+                "balance": validation_European_balance,
+                "demand_by_sector": validation_European_demand_by_sector,
+            },
+        )
+    for df in dfs.values():
+        df['Date'] = pd.to_datetime(df['Date'])
+
+    return dfs['balance'], dfs['demand_by_sector']
+
 
-df_balance = get_European_balance()
+df_balance, df_demand_by_sector = get_European_data()
 df_balance = df_balance.drop(['Timestamp'], axis=1)
 df_balance.to_csv('df_balance.csv', index=False)
 
@@ -0,0 +1,239 @@
+"""Helpers for keeping dashboard chart payloads proportional to the chart size."""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Plot width assumed when deciding how many points a chart can show
+DEFAULT_CHART_WIDTH_PX = 1200
+
+# Resampling kicks in once there are more than this many raw points per pixel
+POINTS_PER_PX = 4
+
+FREQUENCIES = [("D", 1), ("W", 7), ("MS", 30)]
+
+
+def lttb_indices(x, y, n_out):
+    """Selects `n_out` points with the Largest-Triangle-Three-Buckets algorithm.
+
+    Parameters
+    ----------
+    x, y : ndarray
+        Coordinates of the series, with x increasing.
+    n_out : int
+        Number of points to keep. The first and last points are always kept.
+
+    Returns
+    -------
+    ndarray
+        Sorted positions of the kept points.
+
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    # Bucket edges for the n - 2 inner points, the first and last points are fixed
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    selected = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_start = end if end < next_end else n - 1
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        area = np.abs(
+            (x[selected] - avg_x) * (bucket_y - y[selected]) - (x[selected] - bucket_x) * (avg_y - y[selected]),
+        )
+        selected = start + int(np.argmax(area))
+        indices[i + 1] = selected
+    return indices
+
+
+def minmax_indices(y, n_buckets):
+    """Keeps the minimum and the maximum of each of `n_buckets` equal-sized buckets.
+
+    Unlike LTTB this always preserves spikes, which suits noisy daily flows.
+
+    Parameters
+    ----------
+    y : ndarray
+        Values of the series.
+    n_buckets : int
+        Number of buckets. At most two points are kept per bucket.
+
+    Returns
+    -------
+    ndarray
+        Sorted positions of the kept points.
+
+    """
+    n = len(y)
+    if 2 * n_buckets >= n or n_buckets < 1:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype="float64")
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    indices = set()
+    for start, end in zip(edges[:-1], edges[1:]):
+        bucket = y[start:end]
+        indices.add(start + int(np.argmin(bucket)))
+        indices.add(start + int(np.argmax(bucket)))
+    indices.update((0, n - 1))
+    return np.array(sorted(indices), dtype=np.int64)
+
+
+def choose_frequency(start_date, end_date, width_px=DEFAULT_CHART_WIDTH_PX):
+    """Picks the finest of daily, weekly or monthly steps that keeps a chart within budget.
+
+    Parameters
+    ----------
+    start_date, end_date : datetime
+        Span of the chart.
+    width_px : int = DEFAULT_CHART_WIDTH_PX
+        Chart width in pixels.
+
+    Returns
+    -------
+    str
+        Pandas frequency alias: "D", "W" or "MS".
+
+    """
+    days = max((pd.Timestamp(end_date) - pd.Timestamp(start_date)).days, 1)
+    for frequency, step_days in FREQUENCIES:
+        if days / step_days <= width_px * POINTS_PER_PX:
+            return frequency
+    return FREQUENCIES[-1][0]
+
+
+def prepare_series(df, x, y, width_px=DEFAULT_CHART_WIDTH_PX, full_resolution=False, method="lttb"):
+    """Reduces a time series to what a chart of `width_px` pixels can show.
+
+    Long spans are first resampled to weekly or monthly means, then the series is
+    downsampled to about one point per pixel.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Data sorted by `x`.
+    x : str
+        Name of the date column.
+    y : str
+        Name of the value column.
+    width_px : int = DEFAULT_CHART_WIDTH_PX
+        Chart width in pixels.
+    full_resolution : bool = False
+        If true, returns every point untouched.
+    method : str = "lttb"
+        "lttb" for level series, "minmax" to keep the extremes of noisy series.
+
+    Returns
+    -------
+    DataFrame
+        Frame with the `x` and `y` columns only.
+
+    """
+    series = df[[x, y]]
+    if full_resolution or len(series) <= width_px:
+        return series
+
+    series = series.dropna()
+    if series.empty:
+        return series
+    frequency = choose_frequency(series[x].iloc[0], series[x].iloc[-1], width_px)
+    if frequency != "D":
+        series = series.resample(frequency, on=x)[y].mean().dropna().reset_index()
+
+    if method == "minmax":
+        positions = minmax_indices(series[y].to_numpy(), width_px // 2)
+    else:
+        positions = lttb_indices(series[x].to_numpy().astype("int64"), series[y].to_numpy(), width_px)
+    return series.iloc[positions]
+
+
+class FigureCache:
+    """Thread-safe LRU cache of built Plotly figures, bounded by their serialized size.
+
+    Keys should hold everything a figure depends on, e.g. the chart id, the filter state
+    and the data version, so a cached figure never needs to be invalidated explicitly.
+
+    Parameters
+    ----------
+    max_bytes : int = 256 MB
+        Budget for the summed JSON size of the cached figures. The least recently used
+        figures are evicted once it is exceeded.
+
+    """
+
+    def __init__(self, max_bytes=256 * 1024**2):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        """Returns the cached figure for `key`, building and caching it on a miss.
+
+        Parameters
+        ----------
+        key : tuple
+            Hashable cache key.
+        build : callable
+            Called without arguments to build the figure on a miss.
+
+        Returns
+        -------
+        Figure
+            The cached or freshly built figure. It is shared, so callers must not modify it.
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        figure = build()
+        size = len(figure.to_json())
+        if size > self.max_bytes:
+            return figure
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (figure, size)
+                self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+        return figure
+
+    def stats(self):
+        """Returns the hit and miss counters and the current size of the cache."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+            }
+
+    def clear(self):
+        """Drops every cached figure. The counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
@@ -3,18 +3,149 @@
 
 @author: Simene
 """
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
 import uuid
+import warnings
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 
 import pandas as pd
 import pyodbc
 import sqlalchemy
+from sqlalchemy.pool import QueuePool
+
+from Modules.resqlconnection import arrow_fetch, bulk_loader
+
+DEFAULT_DRIVER = "ODBC Driver 17 for SQL Server"
+
+# Pool settings used by get_engine, each can be overridden per call
+DEFAULT_POOL_OPTIONS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_timeout": 30,
+    "pool_recycle": 3600,
+    "pool_pre_ping": True,
+}
+
+# Where sql_to_df_cached keeps its Parquet files
+QUERY_CACHE_DIR = os.getenv("SQL_QUERY_CACHE_DIR", ".sql_cache")
+
+# Seconds a cached query result is used by default, also when it passes its validation query
+QUERY_CACHE_TTL = float(os.getenv("SQL_QUERY_CACHE_TTL", "3600"))
+
+# Engines shared by every MySqlConnection in the process, keyed on server, database,
+# driver and pool options. Creating an engine per instance meant a new Windows-auth
+# login for every loader.
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(server_name, database_name, driver=DEFAULT_DRIVER, **pool_options):
+    """Returns the process-wide pooled engine for a server and database.
+
+    Parameters
+    ----------
+    server_name : str
+        Server name.
+    database_name : str
+        Database name.
+    driver : str = DEFAULT_DRIVER
+        ODBC driver name.
+    **pool_options
+        Overrides of DEFAULT_POOL_OPTIONS, e.g. pool_size=10. Engines with different
+        options are kept apart.
+
+    Returns
+    -------
+    Engine
+        SQLAlchemy engine with a QueuePool, created on the first call.
+
+    """
+    options = {**DEFAULT_POOL_OPTIONS, **pool_options}
+    key = (server_name, database_name, driver, tuple(sorted(options.items())))
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = sqlalchemy.create_engine(
+                "mssql+pyodbc://%s/%s?driver=%s" % (server_name, database_name, driver.replace(" ", "+")),
+                fast_executemany=True,
+                poolclass=QueuePool,
+                **options,
+            )
+            _engines[key] = engine
+    return engine
+
+
+def dispose_engines():
+    """Closes every pooled connection and forgets the shared engines."""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+
+def merge_statement(target, source, columns, match_columns, skip_inserts=False, skip_updates=False):  # noqa: PLR0913
+    """Builds a T-SQL MERGE statement that upserts the rows of `source` into `target`.
+
+    Parameters
+    ----------
+    target : str
+        Quoted name of the target table.
+    source : str
+        Name of the table with the rows to upsert, e.g. a temporary table.
+    columns : list of str
+        Columns to insert or update.
+    match_columns : list of str
+        Columns on which rows of both tables are matched.
+    skip_inserts : bool, optional
+        Skip inserting unmatched rows. (Default: False)
+    skip_updates : bool, optional
+        Skip updating matched rows. (Default: False)
+
+    Returns
+    -------
+    str
+        The MERGE statement.
+
+    """
+    columns_to_update = [col for col in columns if col not in match_columns]
+
+    stmt = f"MERGE {target} WITH (HOLDLOCK) AS main\n"
+    stmt += f"USING (SELECT {', '.join([f'[{col}]' for col in columns])} FROM {source}) AS temp\n"
+
+    join_condition = " AND ".join([f"main.[{col}] = temp.[{col}]" for col in match_columns])
+    stmt += f"ON ({join_condition})"
+
+    if not skip_updates:
+        stmt += "\nWHEN MATCHED THEN\n"
+        update_list = ", ".join([f"[{col}] = temp.[{col}]" for col in columns_to_update])
+        stmt += f"  UPDATE SET {update_list}"
+
+    if not skip_inserts:
+        stmt += "\nWHEN NOT MATCHED THEN\n"
+        insert_cols_str = ", ".join([f"[{col}]" for col in columns])
+        insert_vals_str = ", ".join([f"temp.[{col}]" for col in columns])
+        stmt += f"  INSERT ({insert_cols_str}) VALUES ({insert_vals_str})"
+
+    return stmt + ";"
 
 
 class MySqlConnection:
-    """A convenient method to connect to SQL."""
+    """A convenient method to connect to SQL.
 
-    def __init__(self, server_name, database_name):
-        """Create sql connection, cursor and engine.
+    Instances for the same server and database share one pooled engine. The raw
+    connection and cursor are only checked out of the pool when first used, and are
+    returned to it by `close_connection` or when leaving a `with` block.
+    """
+
+    def __init__(self, server_name, database_name, driver=DEFAULT_DRIVER, **pool_options):
+        """Create sql engine. The connection and cursor are opened lazily.
 
         Parameters
         ----------
@@ -22,20 +153,45 @@ class MySqlConnection:
             Server name.
         database_name : str
             Database name.
+        driver : str = DEFAULT_DRIVER
+            ODBC driver name.
+        **pool_options
+            Overrides of DEFAULT_POOL_OPTIONS for the shared engine.
 
         """
         self.server_name = server_name
         self.database_name = database_name
-        self.params = "DRIVER={ODBC Driver 17 for SQL Server}; SERVER=%s; DATABASE=%s; Trusted_Connection=Yes" % (
+        self.params = "DRIVER={%s}; SERVER=%s; DATABASE=%s; Trusted_Connection=Yes" % (
+            driver,
             self.server_name,
             self.database_name,
         )
-        self.connection = pyodbc.connect(self.params)
-        self.connection_cursor = self.connection.cursor()
-        self.connection_engine = sqlalchemy.create_engine(
-            "mssql+pyodbc://%s/%s?driver=ODBC+Driver+17+for+SQL+Server" % (self.server_name, self.database_name),
-            fast_executemany=True,
-        )
+        self.pool_options = {**DEFAULT_POOL_OPTIONS, **pool_options}
+        self.connection_engine = get_engine(server_name, database_name, driver, **pool_options)
+        self._connection = None
+        self._connection_cursor = None
+        self.query_timings = {}
+        self.upload_report = None
+
+    @property
+    def connection(self):
+        """Pooled pyodbc connection, checked out on first use."""
+        if self._connection is None:
+            self._connection = self.connection_engine.raw_connection()
+        return self._connection
+
+    @property
+    def connection_cursor(self):
+        """Cursor on `connection`, created on first use."""
+        if self._connection_cursor is None:
+            self._connection_cursor = self.connection.cursor()
+        return self._connection_cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close_connection()
 
     def get_connection_information(self):
         print(f"Server: {self.server_name}")
@@ -56,9 +212,271 @@ class MySqlConnection:
         """
         return pd.read_sql_query(query, self.connection_engine)
 
-    def df_to_sql(self, df, table_name, schema):
+    def _query_cache_key(self, query, params):
+        """Hashes the server, database, whitespace-normalized query and parameters."""
+        normalized = re.sub(r"\s+", " ", query).strip()
+        text = json.dumps([self.server_name, self.database_name, normalized, params], default=str)
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    @contextmanager
+    def _connect(self, timeout=None):
+        """Checks out a pooled connection, with a per-statement timeout in seconds if given."""
+        with self.connection_engine.connect() as conn:
+            dbapi_connection = conn.connection.dbapi_connection
+            # pyodbc enforces the timeout on the server side, per statement
+            set_timeout = timeout is not None and hasattr(dbapi_connection, "timeout")
+            if set_timeout:
+                dbapi_connection.timeout = math.ceil(timeout)
+            try:
+                yield conn
+            finally:
+                if set_timeout:
+                    dbapi_connection.timeout = 0
+
+    def _scalar(self, query, timeout=None):
+        with self._connect(timeout) as conn:
+            return conn.execute(sqlalchemy.text(query)).scalar()
+
+    def sql_to_df_cached(self, query, params=None, ttl=None, validation_query=None, cache_dir=None, timeout=None):
+        """Reads query to pandas dataframe through a local Parquet result cache.
+
+        A cached result is used while it is younger than `ttl` and, if a validation
+        query is given, while that query still returns the value it returned when the
+        result was cached. For queries on the latest vintage of a table, validating with
+        `select max(timestamp) ...` costs one scalar query instead of a full transfer.
+
+        Parameters
+        ----------
+        query : str
+            SQL query.
+        params : list or dict (optional)
+            Query parameters, part of the cache key.
+        ttl : float (optional)
+            Maximum age of a cached result in seconds. Defaults to QUERY_CACHE_TTL. Pass
+            math.inf together with a validation query to rely on the validation alone.
+        validation_query : str (optional)
+            Cheap query returning one value that changes whenever the result does.
+        cache_dir : str (optional)
+            Cache directory. Defaults to QUERY_CACHE_DIR.
+        timeout : float (optional)
+            Seconds allowed for the validation query and for the query, where the driver
+            supports query timeouts.
+
+        Returns
+        -------
+        Pandas DataFrame.
+
+        """
+        cache_dir = cache_dir or QUERY_CACHE_DIR
+        ttl = QUERY_CACHE_TTL if ttl is None else ttl
+        if math.isinf(ttl) and validation_query is None:
+            raise ValueError("A cached result without ttl needs a validation_query, it would never expire")
+        key = self._query_cache_key(query, params)
+        data_path = os.path.join(cache_dir, key + ".parquet")
+        meta_path = os.path.join(cache_dir, key + ".json")
+
+        validation_value = None if validation_query is None else str(self._scalar(validation_query, timeout))
+        try:
+            with open(meta_path, encoding="utf-8") as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            meta = None
+
+        if (
+            meta is not None
+            and os.path.exists(data_path)
+            and time.time() - meta["created"] < ttl
+            and meta.get("validation_value") == validation_value
+        ):
+            try:
+                return pd.read_parquet(data_path)
+            except Exception as e:
+                warnings.warn(f"Could not read cached query result, querying the server: {e}", RuntimeWarning, stacklevel=2)
+
+        with self._connect(timeout) as conn:
+            df = pd.read_sql_query(query, conn, params=params)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            df.to_parquet(data_path + ".tmp", index=False)
+            os.replace(data_path + ".tmp", data_path)
+            with open(meta_path, "w", encoding="utf-8") as file:
+                json.dump({"created": time.time(), "validation_value": validation_value, "query": query}, file)
+        except Exception as e:
+            # The cache is best effort, the result is still returned
+            warnings.warn(f"Could not cache query result: {e}", RuntimeWarning, stacklevel=2)
+        return df
+
+    def sql_to_arrow(self, query, schema=None, batch_size=arrow_fetch.DEFAULT_BATCH_SIZE):
+        """Reads query to a pyarrow Table, skipping the pandas object columns.
+
+        Parameters
+        ----------
+        query : str
+            SQL query.
+        schema : pyarrow.Schema (optional)
+            Declared schema of the result. Taken from the cursor if not populated.
+        batch_size : int = arrow_fetch.DEFAULT_BATCH_SIZE
+            Number of rows per fetch.
+
+        Returns
+        -------
+        pyarrow.Table
+
+        """
+        return arrow_fetch.fetch_arrow(self.connection_engine, query, schema, batch_size)
+
+    def sql_to_df_arrow(self, query, schema=None, arrow_dtypes=True):
+        """Reads query to a pandas DataFrame through Arrow.
+
+        Parameters
+        ----------
+        query : str
+            SQL query.
+        schema : pyarrow.Schema (optional)
+            Declared schema of the result. Taken from the cursor if not populated.
+        arrow_dtypes : bool = True
+            If true, the columns are Arrow-backed. Otherwise numpy-backed.
+
+        Returns
+        -------
+        Pandas DataFrame.
+
+        """
+        return arrow_fetch.arrow_to_df(self.sql_to_arrow(query, schema), arrow_dtypes)
+
+    def sql_to_df_chunks(self, query, chunksize=100000):
+        """Reads a query in chunks, keeping memory bounded by the chunk size.
+
+        The result is streamed from a server-side cursor, so only one chunk of rows is
+        held on the client at a time.
+
+        Parameters
+        ----------
+        query : str
+            SQL query.
+        chunksize : int = 100000
+            Number of rows per chunk.
+
+        Yields
+        ------
+        DataFrame
+            Consecutive chunks of the result.
+
+        """
+        with self.connection_engine.connect().execution_options(stream_results=True) as conn:
+            yield from pd.read_sql_query(query, conn, chunksize=chunksize)
+
+    def sql_to_parquet(self, query, path, chunksize=100000, schema=None):
+        """Streams a query straight to a Parquet file, one row group per chunk.
+
+        Parameters
+        ----------
+        query : str
+            SQL query.
+        path : str
+            Target Parquet file.
+        chunksize : int = 100000
+            Number of rows per chunk.
+        schema : pyarrow.Schema (optional)
+            Schema of the file. Taken from the first chunk if not populated, which can
+            be wrong if a column is entirely null in that chunk.
+
+        Returns
+        -------
+        int
+            Number of rows written.
+
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        rows = 0
+        try:
+            for chunk in self.sql_to_df_chunks(query, chunksize):
+                table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                if writer is None:
+                    schema = table.schema
+                    writer = pq.ParquetWriter(path, schema)
+                writer.write_table(table)
+                rows += table.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+
+        print(f"{rows} rows written to {path}")
+        return rows
+
+    def _timed_sql_to_df(self, query, timeout, validation_query=None):
+        """Runs one query on its own pooled connection and returns (DataFrame, seconds)."""
+        start = time.perf_counter()
+        if validation_query is not None:
+            df = self.sql_to_df_cached(query, validation_query=validation_query, timeout=timeout)
+            return df, time.perf_counter() - start
+        with self._connect(timeout) as conn:
+            df = pd.read_sql_query(query, conn)
+        return df, time.perf_counter() - start
+
+    def sql_to_dfs(self, queries, max_workers=None, timeout=None, validation_queries=None):
+        """Reads several independent queries concurrently.
+
+        Every query runs on its own thread and pooled connection, so the total time is
+        that of the slowest query instead of the sum. Timings in seconds are stored in
+        `query_timings`.
+
+        Parameters
+        ----------
+        queries : dict[str, str]
+            SQL queries by name.
+        max_workers : int (optional)
+            Number of threads. Defaults to one per query, capped by the pool size.
+        timeout : float (optional)
+            Seconds allowed per query. Enforced by the driver where it supports query
+            timeouts, and by the batch as a whole otherwise.
+        validation_queries : dict[str, str] (optional)
+            Validation queries by query name. Queries listed here are read through
+            `sql_to_df_cached`, with the same timeout for the validation query.
+
+        Returns
+        -------
+        dict[str, DataFrame]
+            Results by query name.
+
+        """
+        if not queries:
+            return {}
+        pool_limit = self.pool_options["pool_size"] + self.pool_options["max_overflow"]
+        max_workers = max_workers or max(min(len(queries), pool_limit), 1)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sql_to_dfs")
+        try:
+            validation_queries = validation_queries or {}
+            futures = {
+                name: executor.submit(self._timed_sql_to_df, query, timeout, validation_queries.get(name))
+                for name, query in queries.items()
+            }
+            # Queries wait for a free worker, so the batch gets one timeout per round of workers
+            batch_timeout = None if timeout is None else timeout * math.ceil(len(queries) / max_workers)
+            _, not_done = wait(futures.values(), timeout=batch_timeout)
+            if not_done:
+                late = [name for name, future in futures.items() if future in not_done]
+                raise TimeoutError(f"Queries did not finish within {timeout}s: {', '.join(late)}")
+
+            results = {}
+            for name, future in futures.items():
+                results[name], seconds = future.result()
+                self.query_timings[name] = seconds
+                print(f"{name}: {len(results[name].index)} rows in {seconds:.2f}s")
+            return results
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def df_to_sql(self, df, table_name, schema, loaders=None, adaptive=False):
         """Uploads pandas dataframe to sql.
 
+        The rows are sent with the fastest bulk loader the server supports, falling
+        back to `DataFrame.to_sql`. The upload report is kept in `upload_report`.
+
         ### Parameters
         ----------
         df : DataFrame
@@ -67,16 +485,21 @@ class MySqlConnection:
             Table name in SQL database.
         schema : str
             Schema name in SQL database.
+        loaders : list, optional
+            Loaders to try in order. Defaults to `bulk_loader.default_loaders()`.
+        adaptive : bool, optional
+            Tune the batch size to the measured upload throughput. (Default: False)
 
 
         """
-        df.to_sql(
-            name=table_name,
-            con=self.connection_engine,
-            if_exists="append",
-            index=False,
-            schema=schema,
-            chunksize=20000,
+        self.upload_report = bulk_loader.bulk_load(
+            df,
+            table_name,
+            schema,
+            self.connection_engine,
+            loaders=loaders,
+            batch_size=20000,
+            adaptive=adaptive,
         )
 
         print(f"{len(df.index)} rows added to SQL")
@@ -131,26 +554,7 @@ class MySqlConnection:
             insp = sqlalchemy.inspect(self.connection_engine)
             match_columns = insp.get_pk_constraint(table_name, schema=schema)["constrained_columns"]
 
-        columns_to_update = [col for col in df_columns if col not in match_columns]
-
-        stmt = f"MERGE {table_spec} WITH (HOLDLOCK) AS main\n"
-        stmt += f"USING (SELECT {', '.join([f'[{col}]' for col in df_columns])} FROM {temp_table_name}) AS temp\n"
-
-        join_condition = " AND ".join([f"main.[{col}] = temp.[{col}]" for col in match_columns])
-        stmt += f"ON ({join_condition})"
-
-        if not skip_updates:
-            stmt += "\nWHEN MATCHED THEN\n"
-            update_list = ", ".join([f"[{col}] = temp.[{col}]" for col in columns_to_update])
-            stmt += f"  UPDATE SET {update_list}"
-
-        if not skip_inserts:
-            stmt += "\nWHEN NOT MATCHED THEN\n"
-            insert_cols_str = ", ".join([f"[{col}]" for col in df_columns])
-            insert_vals_str = ", ".join([f"temp.[{col}]" for col in df_columns])
-            stmt += f"  INSERT ({insert_cols_str}) VALUES ({insert_vals_str})"
-
-        stmt += ";"
+        stmt = merge_statement(table_spec, temp_table_name, df_columns, match_columns, skip_inserts, skip_updates)
 
         with self.connection_engine.begin() as conn:
             data_frame.to_sql(temp_table_name, conn, index=False, chunksize=chunksize, dtype=dtype)
@@ -221,8 +625,13 @@ class MySqlConnection:
             return results
 
     def close_connection(self):
-        """Closes the SQL connection."""
-        self.connection.close()
+        """Returns the SQL connection to the pool. The shared engine stays open."""
+        if self._connection_cursor is not None:
+            self._connection_cursor.close()
+            self._connection_cursor = None
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
 
     def df_to_new_table(self, df, table_name, schema, **kwargs):
         """Uploads pandas dataframe to sql.
@@ -240,10 +649,13 @@ class MySqlConnection:
         """
         # Default values:
         len_varchar = 255
+        adaptive = False
 
         for key, value in kwargs.items():
             if key == "varchar":
                 len_varchar = value
+            if key == "adaptive":
+                adaptive = value
 
         print(
             f"Creating new table {self.server_name}.{self.database_name}.{schema}.{table_name} and uploading {len(df)} rows",
@@ -265,15 +677,24 @@ class MySqlConnection:
             if "int" in str(j):
                 dtypedict.update({i: sqlalchemy.types.INT()})
 
-        df.to_sql(
+        # Create the empty table with the column types, then bulk load the rows into it
+        df.head(0).to_sql(
             name=table_name,
             con=self.connection_engine,
             if_exists="replace",
             index=False,
             schema=schema,
-            chunksize=100000,
             dtype=dtypedict,
         )
+        self.upload_report = bulk_loader.bulk_load(
+            df,
+            table_name,
+            schema,
+            self.connection_engine,
+            loaders=bulk_loader.default_loaders(dtype=dtypedict),
+            batch_size=100000,
+            adaptive=adaptive,
+        )
 
         print("All done! :D")
 
@@ -0,0 +1,150 @@
+"""Vectorized change detection between freshly crawled data and the data already stored.
+
+Rows are matched on a single 64-bit integer code packed from their key columns instead
+of merging on the key columns themselves, and values are compared as integers quantized
+to a number of decimals. Both steps work on numpy integer arrays, so no merged frame of
+object columns is built.
+"""
+
+import numpy as np
+import pandas as pd
+
+NEW = "new"
+CHANGED = "changed"
+UNCHANGED = "unchanged"
+
+
+def _comparable(old_values, new_values):
+    """Casts `new_values` to the dtype of `old_values`, so equal keys are encoded equally.
+
+    Values that cannot be cast are compared as strings on both sides.
+    """
+    if new_values.dtype == old_values.dtype:
+        return old_values, new_values
+    try:
+        return old_values, new_values.astype(old_values.dtype)
+    except (TypeError, ValueError):
+        return old_values.astype(str), new_values.astype(str)
+
+
+def key_codes(df_new, df_old, key_columns):
+    """Encodes the key columns of both frames into one int64 key code per row.
+
+    Every key column is factorized over the old and new rows together, and the column
+    codes are packed into a single integer. The packed key is re-factorized whenever it
+    would overflow, so matching is exact and there are no hash collisions.
+
+    Returns
+    -------
+    tuple[ndarray, ndarray]
+        Dense codes of the old rows, numbered in order of first appearance, and the code
+        of the matching old key for every new row (-1 if the key is not in `df_old`).
+
+    """
+    n_old = len(df_old.index)
+    key = np.zeros(n_old + len(df_new.index), dtype=np.int64)
+    size = 1
+    for col in key_columns:
+        old_values, new_values = _comparable(df_old[col], df_new[col])
+        values = np.concatenate([np.asarray(old_values), np.asarray(new_values)])
+        codes, uniques = pd.factorize(values)
+        # Missing keys get their own code, so they match each other like in a merge
+        cardinality = len(uniques) + 1
+        codes[codes < 0] = len(uniques)
+        if size * cardinality >= 2**62:
+            key, packed = pd.factorize(key)
+            size = len(packed)
+        key = key * cardinality + codes
+        size *= cardinality
+
+    # Old keys are factorized first, so their codes come before those of keys only seen in new rows
+    key, _ = pd.factorize(key)
+    old_key, new_key = key[:n_old], key[n_old:]
+    n_old_keys = old_key.max() + 1 if n_old else 0
+    return old_key, np.where(new_key < n_old_keys, new_key, -1)
+
+
+def quantize(values, decimals=3):
+    """Rounds values to `decimals` decimals and returns them as int64, with a NaN mask.
+
+    Two values are equal after `round(decimals)` exactly when their quantized integers
+    are equal.
+    """
+    values = pd.to_numeric(values, errors="coerce").to_numpy(dtype="float64")
+    missing = np.isnan(values)
+    scaled = np.rint(np.where(missing, 0, values) * 10**decimals)
+    return scaled.astype(np.int64), missing
+
+
+def classify_rows(  # noqa: PLR0913
+    df_new,
+    df_old,
+    key_columns,
+    new_value_column="Value",
+    old_value_column="old_Value",
+    decimals=3,
+):
+    """Classifies every new row as new, changed or unchanged against the stored data.
+
+    Parameters
+    ----------
+    df_new : DataFrame
+        Freshly crawled data.
+    df_old : DataFrame
+        Stored data with the key columns and `old_value_column`. If a key occurs more
+        than once, its first row is used.
+    key_columns : list[str]
+        Columns identifying a data point.
+    new_value_column : str = "Value"
+        Value column of `df_new`.
+    old_value_column : str = "old_Value"
+        Value column of `df_old`.
+    decimals : int = 3
+        Values that are equal at this precision are unchanged.
+
+    Returns
+    -------
+    tuple[ndarray, ndarray]
+        Status of every row of `df_new` ("new", "changed" or "unchanged") and the
+        matching old value (NaN for new rows).
+
+    """
+    old_codes, new_codes = key_codes(df_new, df_old, key_columns)
+
+    # Row of the first occurrence of every old key
+    first = np.empty(old_codes.max() + 1 if len(old_codes) else 0, dtype=np.int64)
+    first[old_codes[::-1]] = np.arange(len(old_codes) - 1, -1, -1)
+    found = new_codes >= 0
+    old_rows = first[new_codes[found]]
+
+    matched_old = np.full(len(new_codes), np.nan)
+    matched_old[found] = pd.to_numeric(df_old[old_value_column], errors="coerce").to_numpy(dtype="float64")[old_rows]
+
+    new_quantized, new_missing = quantize(df_new[new_value_column], decimals)
+    old_quantized, old_missing = quantize(pd.Series(matched_old), decimals)
+    # NaN never equals anything, like the float comparison this replaces
+    same = (new_quantized == old_quantized) & ~new_missing & ~old_missing
+
+    status = np.full(len(new_codes), CHANGED, dtype=object)
+    status[~found] = NEW
+    status[found & same] = UNCHANGED
+    return status, matched_old
+
+
+def changed_rows(df_new, df_old, key_columns, new_value_column="Value", old_value_column="old_Value", decimals=3):
+    """Returns the new and changed rows of `df_new`, with the old value attached.
+
+    Parameters are the same as for `classify_rows`.
+
+    Returns
+    -------
+    DataFrame
+        Rows of `df_new` that are new or whose value changed, with an
+        `old_value_column` column, and a fresh index.
+
+    """
+    status, old_values = classify_rows(df_new, df_old, key_columns, new_value_column, old_value_column, decimals)
+    keep = status != UNCHANGED
+    df_changed = df_new.loc[keep].copy()
+    df_changed[old_value_column] = old_values[keep]
+    return df_changed.reset_index(drop=True)
@@ -98,6 +98,45 @@ class resqlconnection:
             recipients,
         )
 
+    def push_many(
+        self,
+        data,
+        value_columns,
+        column_name_list=None,
+        crawldate_column="CrawlDate",
+        replace=False,
+        ignore_duplicates_check=False,
+        recipients=None,
+        max_workers=None,
+        staged=None,
+    ):
+        """Pushes data to several tables at once. The tables are pushed in parallel, and one notification is sent
+        for all of them
+        :param data: dict mapping (schema_name, table_name) to the data to be pushed to that table
+        :param value_columns: List with name of columns where values are, or a dict with a list per (schema_name, table_name)
+        :param column_name_list: List with name of columns, or a dict with a list per (schema_name, table_name). Only important if input is on list format
+        :param crawldate_column: String describing name of crawl_date column. Default is 'CrawlDate'
+        :param replace: Boolean describing if replacing old values or discarding new ones when a duplicate happens.
+        :param ignore_duplicates_check True if you want no duplicate check to run
+        :param recipients list or string with emails that will receive the notification
+        :param max_workers number of tables pushed at the same time. Default is the connection pool size
+        :param staged True to merge every table through a staging table, committed in a single transaction.
+                Defaults to the set_staged_upload setting
+        :return: Dataframe with a summary row per table
+        """
+        return self.method.push_many(
+            data,
+            column_name_list if column_name_list is not None else [],
+            value_columns,
+            crawldate_column,
+            replace,
+            ignore_duplicates_check,
+            self.sql_conn,
+            recipients,
+            max_workers,
+            staged,
+        )
+
     def remove_duplicates(self, table_name, schema_name, replace, value_columns):
         """Method for removing duplicate rows from SQL database
         :param table_name: String with name of table
@@ -125,6 +164,19 @@ class resqlconnection:
         """:param max_varchar_size size of maximum length of varchar"""
         self.method.set_max_varchar(max_varchar_size)
 
+    def set_adaptive_batches(self, adaptive):
+        """:param adaptive True to tune upload batch sizes to the measured throughput, within the
+        driver's parameter limit and a memory cap. The chosen size and the throughput curve are logged
+        """
+        self.method.set_adaptive_batches(adaptive)
+
+    def set_staged_upload(self, staged):
+        """:param staged True to deduplicate pushes in pandas, load them into a staging table and merge only
+        the pushed partitions into the target table. Keeps the replace / keep-old behaviour of push_data,
+        without deduplicating the whole table on every push
+        """
+        self.method.set_staged_upload(staged)
+
     def get_newest_date(self, table_name, schema_name, date_column_name):
         """Getting the newest date present
         :param date_column_name: name of column in database that holds date
@@ -136,6 +188,21 @@ class resqlconnection:
             self.sql_conn,
         )
 
+    def flush_monitoring(self):
+        """Writes the buffered monitoring records to Info.MonitoringTable now, instead of waiting for the
+        background flush or the process exit
+        :return: number of records written
+        """
+        return self.method.flush_monitoring(self.sql_conn)
+
     def get_row_count(self, table_name, schema_name):
-        """Getting the number of rows"""
+        """Getting the number of rows, from the partition statistics of the table"""
         return self.method.get_row_count(table_name, schema_name, self.sql_conn)
+
+    def invalidate_table_metadata(self, table_name, schema_name):
+        """Forgets the cached columns of a table. Only needed when the table is altered
+        outside of this library, the library invalidates the tables it alters itself
+        :param table_name: Name of table, or None for every table of the schema
+        :param schema_name: Name of schema
+        """
+        self.method.invalidate_table_metadata(table_name, schema_name, self.sql_conn)
@@ -0,0 +1,218 @@
+"""Fetches SQL query results as Arrow tables, without building pandas object columns.
+
+Drivers with a native Arrow fetch (ADBC, DuckDB) are read columnar. pyodbc has none:
+its rows still arrive as Python tuples, which are turned into one typed Arrow array per
+column and batch. That skips pandas' per-value dtype inference and object columns, not
+the Python objects of the driver itself.
+
+pyarrow is imported lazily, so the SQL helpers that use this module keep working in
+environments without it until an Arrow fetch is requested.
+"""
+
+import datetime
+import decimal
+
+DEFAULT_BATCH_SIZE = 100000
+
+
+def _arrow_type(type_code):
+    """Maps the Python type reported in a DB-API cursor description to an Arrow type.
+
+    Returns None if the type is unknown (e.g. sqlite reports no types), in which case
+    the type is inferred from the values.
+    """
+    import pyarrow as pa
+
+    types = {
+        bool: pa.bool_(),
+        int: pa.int64(),
+        float: pa.float64(),
+        str: pa.string(),
+        bytes: pa.binary(),
+        bytearray: pa.binary(),
+        datetime.datetime: pa.timestamp("us"),
+        datetime.date: pa.date32(),
+        datetime.time: pa.time64("us"),
+    }
+    if type_code is decimal.Decimal:
+        # Numeric columns are converted to floats, like pandas does
+        return pa.float64()
+    return types.get(type_code)
+
+
+def cursor_schema(description):
+    """Builds an Arrow schema from a DB-API cursor description.
+
+    Parameters
+    ----------
+    description : sequence
+        `cursor.description` of an executed query.
+
+    Returns
+    -------
+    pyarrow.Schema or None
+        The schema, or None if the driver does not report every column's type.
+
+    """
+    import pyarrow as pa
+
+    fields = []
+    for column in description:
+        arrow_type = _arrow_type(column[1])
+        if arrow_type is None:
+            return None
+        fields.append(pa.field(column[0], arrow_type))
+    return pa.schema(fields)
+
+
+def _column_array(values, arrow_type):
+    import pyarrow as pa
+
+    if arrow_type is not None and pa.types.is_floating(arrow_type):
+        # Decimals are not accepted by pa.array for float types
+        values = [None if value is None else float(value) for value in values]
+    return pa.array(values, type=arrow_type)
+
+
+def iter_record_batches(cursor, schema=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Converts the rows of an executed cursor to Arrow record batches.
+
+    Rows are fetched `batch_size` at a time and each column is turned into one typed
+    Arrow array, so no per-value pandas object or dtype inference is involved.
+
+    Parameters
+    ----------
+    cursor : DB-API cursor
+        Cursor on which a query was executed.
+    schema : pyarrow.Schema (optional)
+        Declared schema of the result. Taken from the cursor description if not
+        populated, and inferred per batch if the driver reports no types. Inferred
+        batches can differ in schema, see `unify_batches`.
+    batch_size : int = DEFAULT_BATCH_SIZE
+        Number of rows per batch.
+
+    Yields
+    ------
+    pyarrow.RecordBatch
+        Consecutive batches of the result.
+
+    """
+    import pyarrow as pa
+
+    names = [column[0] for column in cursor.description]
+    schema = schema or cursor_schema(cursor.description)
+    # Types seen so far for an inferred schema, so a column that is all NULL in a later batch keeps them
+    inferred = {}
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        if schema is None:
+            arrays = []
+            for name, column in zip(names, columns):
+                array = pa.array(column)
+                if pa.types.is_null(array.type) and name in inferred:
+                    array = array.cast(inferred[name])
+                elif not pa.types.is_null(array.type):
+                    inferred.setdefault(name, array.type)
+                arrays.append(array)
+            batch_schema = pa.schema([pa.field(name, array.type) for name, array in zip(names, arrays)])
+            yield pa.RecordBatch.from_arrays(arrays, schema=batch_schema)
+        else:
+            arrays = [_column_array(column, field.type) for column, field in zip(columns, schema)]
+            yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def unify_batches(batches):
+    """Casts record batches with inferred schemas to one common schema.
+
+    A column that is all NULL in the first batches is inferred as `null` there, and a
+    column can be inferred as integer in one batch and as float in another.
+
+    Parameters
+    ----------
+    batches : list[pyarrow.RecordBatch]
+        Batches of one result, e.g. from `iter_record_batches`.
+
+    Returns
+    -------
+    list[pyarrow.RecordBatch]
+        The batches, all with the same schema.
+
+    """
+    import pyarrow as pa
+
+    schema = pa.unify_schemas([batch.schema for batch in batches], promote_options="permissive")
+    return [batch if batch.schema.equals(schema) else batch.cast(schema) for batch in batches]
+
+
+def fetch_arrow(engine, query, schema=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Runs a query and returns the result as an Arrow table.
+
+    Drivers with a native Arrow fetch (ADBC, DuckDB) are read through it directly.
+    Other drivers, e.g. pyodbc, go through `iter_record_batches`.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        Engine to run the query on.
+    query : str
+        SQL query.
+    schema : pyarrow.Schema (optional)
+        Declared schema of the result, see `iter_record_batches`.
+    batch_size : int = DEFAULT_BATCH_SIZE
+        Number of rows per fetch.
+
+    Returns
+    -------
+    pyarrow.Table
+        The result.
+
+    """
+    import pyarrow as pa
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(query)
+            if hasattr(cursor, "fetch_arrow_table"):
+                table = cursor.fetch_arrow_table()
+                return table.cast(schema) if schema is not None else table
+
+            batches = list(iter_record_batches(cursor, schema, batch_size))
+            if batches:
+                return pa.Table.from_batches(unify_batches(batches))
+            schema = schema or cursor_schema(cursor.description)
+            if schema is None:
+                schema = pa.schema([pa.field(column[0], pa.null()) for column in cursor.description])
+            return schema.empty_table()
+        finally:
+            cursor.close()
+    finally:
+        connection.close()
+
+
+def arrow_to_df(table, arrow_dtypes=True):
+    """Converts an Arrow table to pandas.
+
+    Parameters
+    ----------
+    table : pyarrow.Table
+        Table to convert.
+    arrow_dtypes : bool = True
+        If true, the columns keep their Arrow memory (pandas ArrowDtype). Otherwise
+        they are converted to the usual numpy-backed dtypes.
+
+    Returns
+    -------
+    DataFrame
+        The table as a DataFrame.
+
+    """
+    if arrow_dtypes:
+        import pandas as pd
+
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    return table.to_pandas()
@@ -0,0 +1,414 @@
+"""Pluggable bulk upload of DataFrames into existing SQL tables.
+
+`bulk_load` tries a list of loaders in order and falls back to the next one when a
+loader does not support the engine or fails. Every loader runs in a single transaction,
+also on engines created with AUTOCOMMIT (see `connect`), so a failed attempt leaves
+nothing behind for the next loader to duplicate. The last default loader is the plain
+`DataFrame.to_sql` path the SQL helpers used before.
+
+Set BULK_INSERT_DIR to a directory the SQL Server can read (e.g. a UNC share) to enable
+the BULK INSERT loader.
+"""
+
+import math
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+import sqlalchemy
+
+DEFAULT_BATCH_SIZE = 50000
+
+# SQL Server accepts at most 2100 parameters per statement
+MSSQL_MAX_PARAMETERS = 2100
+
+# Client-side memory allowed for one batch of an upload
+DEFAULT_BATCH_MEMORY_BYTES = 64 * 1024**2
+
+
+def table_spec(engine, table_name, schema=None):
+    """Returns the quoted, schema-qualified table name for the engine's dialect."""
+    quote = engine.dialect.identifier_preparer.quote
+    if schema:
+        return f"{quote(schema)}.{quote(table_name)}"
+    return quote(table_name)
+
+
+@contextmanager
+def connect(engine):
+    """Yields a connection of `engine` on which transactions are real.
+
+    On engines created with isolation_level="AUTOCOMMIT" every statement commits on its
+    own, so BEGIN, ROLLBACK and savepoints do nothing. The connection is switched to the
+    database's default isolation level (e.g. READ COMMITTED) until it goes back to the pool.
+    """
+    with engine.connect() as conn:
+        level = conn.dialect.default_isolation_level or "READ COMMITTED"
+        if level != "AUTOCOMMIT":
+            conn = conn.execution_options(isolation_level=level)
+        yield conn
+
+
+@contextmanager
+def transaction(bind):
+    """Yields a connection in a transaction on `bind`.
+
+    An engine gets a new connection and transaction. A connection, e.g. one that owns a
+    temporary table, is used as is, inside a savepoint, so a failed loader only rolls back
+    its own rows. The connection must come from `connect`, savepoints need a transaction.
+    """
+    if isinstance(bind, sqlalchemy.engine.Connection):
+        with bind.begin_nested():
+            yield bind
+    else:
+        with connect(bind) as conn, conn.begin():
+            yield conn
+
+
+def python_rows(df):
+    """Converts a DataFrame to tuples of plain Python values, with None for missing values."""
+    columns = []
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            values = pd.Series(values.to_numpy(dtype="datetime64[us]").astype(object), index=df.index, dtype=object)
+        else:
+            values = values.astype(object)
+        columns.append(values.where(df[col].notna(), None).tolist())
+    return list(zip(*columns))
+
+
+class AdaptiveBatchSizer:
+    """Picks upload batch sizes from the throughput measured on the previous batches.
+
+    Starts at `initial_size` and keeps growing (or shrinking) the batch by `factor` while
+    rows per second improve. When a step makes things worse, the search turns around
+    from the best size seen with a smaller step, until the step is too small to matter.
+
+    Parameters
+    ----------
+    initial_size : int
+        Size of the first batch.
+    min_size : int = 100
+        Smallest batch.
+    max_size : int (optional)
+        Largest batch, e.g. from the driver's parameter limit or a memory cap.
+    factor : float = 2.0
+        Initial growth factor between batches.
+
+    """
+
+    def __init__(self, initial_size, min_size=100, max_size=None, factor=2.0):
+        self.min_size = max(int(min_size), 1)
+        self.max_size = max(int(max_size), self.min_size) if max_size else None
+        self.size = self._clamp(initial_size)
+        self.factor = factor
+        self.direction = 1
+        self.best_size = None
+        self.best_rate = None
+        self.history = []
+
+    def _clamp(self, size):
+        size = max(int(size), self.min_size)
+        return min(size, self.max_size) if self.max_size else size
+
+    @property
+    def settled(self):
+        """True once the step between sizes has become negligible."""
+        return self.factor < 1.1
+
+    def next_size(self):
+        """Returns the size of the next batch."""
+        return self.size
+
+    def record(self, rows, seconds):
+        """Feeds back the time it took to upload a batch of `rows` rows."""
+        rate = rows / seconds if seconds > 0 else float("inf")
+        self.history.append((rows, rate))
+        # A short final batch is not comparable with the full ones
+        if rows < self.size or self.settled:
+            return
+
+        if self.best_rate is None or rate > self.best_rate * 1.05:
+            self.best_size, self.best_rate = rows, max(rate, self.best_rate or 0)
+        else:
+            self.direction = -self.direction
+            self.factor = math.sqrt(self.factor)
+        next_size = self._clamp(self.best_size * self.factor**self.direction)
+        if next_size == self.size and self.size in (self.min_size, self.max_size):
+            # Hit a bound, search the other side with a smaller step
+            self.direction = -self.direction
+            self.factor = math.sqrt(self.factor)
+            next_size = self._clamp(self.best_size * self.factor**self.direction)
+        self.size = self.best_size if self.settled else next_size
+
+    def report(self):
+        """Returns the chosen size, the (rows, rows per second) of every batch and the
+        mean rows per second of every batch size tried."""
+        rates = {}
+        for rows, rate in self.history:
+            rates.setdefault(rows, []).append(rate)
+        return {
+            "chosen_batch_size": self.best_size or self.size,
+            "batches": list(self.history),
+            "throughput_by_size": {rows: sum(values) / len(values) for rows, values in sorted(rates.items())},
+        }
+
+
+def iter_batches(df, batch_size):
+    """Yields consecutive slices of `df`.
+
+    `batch_size` is either a number of rows or an `AdaptiveBatchSizer`. The sizer is fed
+    the time the consumer spent on each slice before the next one is sized, so loaders
+    only need to process the batches in a loop.
+    """
+    sizer = batch_size if isinstance(batch_size, AdaptiveBatchSizer) else None
+    start = 0
+    while start < len(df.index):
+        size = sizer.next_size() if sizer else batch_size
+        batch = df.iloc[start : start + size]
+        began = time.perf_counter()
+        yield batch
+        if sizer:
+            sizer.record(len(batch.index), time.perf_counter() - began)
+        start += size
+
+
+def batch_size_limit(df, max_rows=None, memory_bytes=DEFAULT_BATCH_MEMORY_BYTES):
+    """Returns the largest batch that fits in `memory_bytes` and `max_rows`."""
+    row_bytes = df.memory_usage(index=False, deep=True).sum() / max(len(df.index), 1)
+    limit = max(int(memory_bytes / max(row_bytes, 1)), 1)
+    return min(limit, max_rows) if max_rows else limit
+
+
+class ToSqlLoader:
+    """Uploads through `DataFrame.to_sql`. Works with any engine, used as the fallback.
+
+    Parameters
+    ----------
+    method : str or callable (optional)
+        Passed on to `to_sql`, e.g. "multi".
+    chunksize : int (optional)
+        Passed on to `to_sql`. Defaults to the batch size of `bulk_load`.
+    dtype : dict (optional)
+        Column types passed on to `to_sql`.
+
+    """
+
+    name = "to_sql"
+
+    def __init__(self, method=None, chunksize=None, dtype=None):
+        self.method = method
+        self.chunksize = chunksize
+        self.dtype = dtype
+
+    def supports(self, engine):
+        return True
+
+    def max_batch_rows(self, df, engine):
+        if self.method == "multi" and engine.dialect.name == "mssql":
+            # One multi-row INSERT per batch, bound by the parameter limit
+            return max(MSSQL_MAX_PARAMETERS // len(df.columns) - 1, 1)
+        return None
+
+    def _to_sql(self, df, table_name, schema, conn, chunksize):
+        df.to_sql(
+            table_name,
+            con=conn,
+            schema=schema,
+            if_exists="append",
+            index=False,
+            chunksize=chunksize,
+            method=self.method,
+            dtype=self.dtype,
+        )
+
+    def load(self, df, table_name, schema, engine, batch_size):
+        with transaction(engine) as conn:
+            if isinstance(batch_size, AdaptiveBatchSizer):
+                # Every batch is its own to_sql call, so the sizer can time it
+                for batch in iter_batches(df, batch_size):
+                    self._to_sql(batch, table_name, schema, conn, len(batch.index))
+            else:
+                # One call, to_sql splits the frame into chunks itself and checks the table only once
+                self._to_sql(df, table_name, schema, conn, self.chunksize or batch_size)
+        return len(df.index)
+
+
+class ExecutemanyLoader:
+    """Sends batches of rows as parameter arrays with the driver's `executemany`.
+
+    With pyodbc `fast_executemany` is switched on, so every batch is bound as one array
+    and sent in a single round trip, instead of one statement per chunk of rows.
+    """
+
+    name = "executemany"
+
+    def supports(self, engine):
+        return engine.dialect.paramstyle == "qmark"
+
+    def max_batch_rows(self, df, engine):
+        # Parameters are bound as arrays, so only memory limits the batch
+        return None
+
+    def load(self, df, table_name, schema, engine, batch_size):
+        quote = engine.dialect.identifier_preparer.quote
+        columns = ", ".join(quote(col) for col in df.columns)
+        placeholders = ", ".join("?" for _ in df.columns)
+        statement = f"INSERT INTO {table_spec(engine, table_name, schema)} ({columns}) VALUES ({placeholders})"
+
+        with transaction(engine) as conn:
+            # The driver's own cursor, committed or rolled back with the transaction
+            cursor = conn.connection.cursor()
+            try:
+                if hasattr(cursor, "fast_executemany"):
+                    cursor.fast_executemany = True
+                for batch in iter_batches(df, batch_size):
+                    cursor.executemany(statement, python_rows(batch))
+            finally:
+                cursor.close()
+        return len(df.index)
+
+
+class BulkInsertLoader:
+    """Writes the frame to a CSV file and loads it with SQL Server's BULK INSERT.
+
+    The file must be readable by the server, so the loader is only used when a shared
+    directory is configured.
+
+    Parameters
+    ----------
+    directory : str (optional)
+        Directory shared with the server. Defaults to the BULK_INSERT_DIR variable.
+
+    """
+
+    name = "bulk_insert"
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.getenv("BULK_INSERT_DIR")
+
+    def supports(self, engine):
+        return bool(self.directory) and engine.dialect.name == "mssql"
+
+    def max_batch_rows(self, df, engine):
+        return None
+
+    def load(self, df, table_name, schema, engine, batch_size):
+        # BULK INSERT maps fields by position, so the file follows the table's column order
+        table_columns = [col["name"] for col in sqlalchemy.inspect(engine).get_columns(table_name, schema=schema)]
+        unknown = [col for col in df.columns if col not in table_columns]
+        if unknown:
+            raise ValueError(f"Columns not in {schema}.{table_name}: {', '.join(map(str, unknown))}")
+        df = df.reindex(columns=table_columns)
+        for col in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[col]):
+                df[col] = df[col].dt.strftime("%Y-%m-%d %H:%M:%S.%f").str[:-3]
+
+        path = os.path.join(self.directory, f"{uuid.uuid4().hex}.csv")
+        df.to_csv(path, index=False, header=False, encoding="utf-8", lineterminator="\n")
+        if isinstance(batch_size, AdaptiveBatchSizer):
+            # The server batches the file itself, there is nothing to adapt on the client
+            batch_size = batch_size.next_size()
+        try:
+            statement = (
+                f"BULK INSERT {table_spec(engine, table_name, schema)} FROM '{path}' "
+                f"WITH (FORMAT = 'CSV', CODEPAGE = '65001', FIELDTERMINATOR = ',', "
+                f"ROWTERMINATOR = '0x0a', TABLOCK, BATCHSIZE = {int(batch_size)})"
+            )
+            with transaction(engine) as conn:
+                conn.exec_driver_sql(statement)
+        finally:
+            os.remove(path)
+        return len(df.index)
+
+
+def default_loaders(dtype=None, method=None):
+    """Returns the loaders tried by `bulk_load`, fastest first."""
+    return [BulkInsertLoader(), ExecutemanyLoader(), ToSqlLoader(method=method, dtype=dtype)]
+
+
+def bulk_load(  # noqa: PLR0913
+    df,
+    table_name,
+    schema,
+    engine,
+    loaders=None,
+    batch_size=DEFAULT_BATCH_SIZE,
+    dtype=None,
+    adaptive=False,
+    memory_bytes=DEFAULT_BATCH_MEMORY_BYTES,
+):
+    """Appends a DataFrame to a table with the first loader that succeeds.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Data to upload.
+    table_name : str
+        Table name in SQL database. Created from the frame's columns if missing.
+    schema : str
+        Schema name in SQL database.
+    engine : sqlalchemy.engine.Engine or sqlalchemy.engine.Connection
+        Target engine. A connection keeps every step on one session, which temporary
+        tables need; every loader then runs in a savepoint of its transaction.
+    loaders : list (optional)
+        Loaders to try in order. Defaults to `default_loaders(dtype)`.
+    batch_size : int = DEFAULT_BATCH_SIZE
+        Rows per batch, or the first batch size if `adaptive`. Capped by `memory_bytes`
+        and the loader's parameter limit.
+    dtype : dict (optional)
+        Column types used when the table is created.
+    adaptive : bool = False
+        If true, batch sizes are tuned to the measured rows per second, within
+        `memory_bytes` and the loader's parameter limit.
+    memory_bytes : int = DEFAULT_BATCH_MEMORY_BYTES
+        Memory allowed for one batch.
+
+    Returns
+    -------
+    dict
+        Upload report with the loader used, rows, seconds and rows_per_second. Adaptive
+        uploads add the chosen batch size and the size and throughput of every batch.
+
+    """
+    loaders = loaders or default_loaders(dtype)
+    if not sqlalchemy.inspect(engine).has_table(table_name, schema=schema):
+        df.head(0).to_sql(table_name, con=engine, schema=schema, index=False, dtype=dtype)
+
+    errors = []
+    last_error = None
+    for loader in loaders:
+        if not loader.supports(engine):
+            continue
+        # Only the multi-row INSERT of to_sql is bound by the parameter limit, the other loaders by memory
+        max_size = batch_size_limit(df, loader.max_batch_rows(df, engine), memory_bytes)
+        sizer = AdaptiveBatchSizer(min(batch_size, max_size), max_size=max_size) if adaptive else None
+        start = time.perf_counter()
+        try:
+            rows = loader.load(df, table_name, schema, engine, sizer or min(batch_size, max_size))
+        except Exception as e:
+            print(f"{loader.name} upload to {schema}.{table_name} failed, falling back: {e}")
+            errors.append(f"{loader.name}: {e}")
+            last_error = e
+            continue
+        seconds = time.perf_counter() - start
+        report = {
+            "loader": loader.name,
+            "rows": rows,
+            "seconds": seconds,
+            "rows_per_second": rows / seconds if seconds > 0 else float("inf"),
+        }
+        print(f"{rows} rows loaded into {schema}.{table_name} with {loader.name} ({report['rows_per_second']:,.0f} rows/s)")
+        if sizer:
+            report.update(sizer.report())
+            curve = ", ".join(f"{size}: {rate:,.0f}" for size, rate in report["throughput_by_size"].items())
+            print(
+                f"Adaptive upload to {schema}.{table_name} chose {report['chosen_batch_size']} rows per batch "
+                f"(rows/s by batch size: {curve})"
+            )
+        return report
+
+    raise RuntimeError(f"Every loader failed for {schema}.{table_name}: " + "; ".join(errors)) from last_error
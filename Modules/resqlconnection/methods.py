@@ -1,4 +1,6 @@
-import math
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 
 import numpy as np
@@ -6,6 +8,8 @@ import pandas
 import pandas as pd
 import sqlalchemy as sal
 
+from . import bulk_loader, monitoring
+
 """
 Created 05.07.2021
 
@@ -15,23 +19,52 @@ Created 05.07.2021
 
 class Method:
     max_varchar = 255
+    upload_report = None
+    # Tune upload batch sizes to the measured throughput instead of the fixed chunksize
+    adaptive_batches = False
+    # Merge pushes through a staging table, deduplicating only the pushed partitions
+    staged_upload = False
 
     def __init__(self, varchar_size):
         """:param max_varchar_size size of maximum length of varchar"""
         self.set_max_varchar(varchar_size)
+        # Columns per table, so a push does not query INFORMATION_SCHEMA repeatedly
+        self.table_metadata = {}
+
+    def _metadata(self, table_name, schema_name, sql_conn):
+        server_name, db_name = sql_conn.get_names()
+        return self.table_metadata.setdefault((server_name, db_name, schema_name, table_name), {})
+
+    def invalidate_table_metadata(self, table_name, schema_name, sql_conn):
+        """Forgets the cached columns of a table. Called whenever the library alters the table
+        :parameter table_name name of table, or None for every table of the schema
+        :parameter schema_name name of schema
+        :parameter sql_conn instance of SQLConnection class
+        """
+        server_name, db_name = sql_conn.get_names()
+        for key in list(self.table_metadata):
+            if key[:3] == (server_name, db_name, schema_name) and table_name in (None, key[3]):
+                del self.table_metadata[key]
 
-    def get_table_columns(self, table_name, schema_name, sql_conn):
-        """Method for returning table columns
+    def get_table_columns(self, table_name, schema_name, sql_conn, refresh=False):
+        """Method for returning table columns. Columns are cached until the library alters the table
         :parameter table_name name of table
         :parameter schema_name name of schema
         :parameter sql_conn instance of SQLConnection class
+        :parameter refresh True to read the columns from the database even if they are cached
 
         :returns Dataframe with columns in SQL table
         """
+        metadata = self._metadata(table_name, schema_name, sql_conn)
+        if "columns" in metadata and not refresh:
+            return metadata["columns"].copy()
         columns = sql_conn.read_to_df(
             "SELECT COLUMN_NAME,DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS "
             + f"WHERE TABLE_NAME = '{table_name}' AND TABLE_SCHEMA ='{schema_name}'",
         )
+        # A table that does not exist yet has no columns, and is not cached
+        if len(columns) > 0:
+            metadata["columns"] = columns.copy()
         return columns
 
     def get_table_info(self, table_name, schema_name, sql_conn):
@@ -44,11 +77,7 @@ class Method:
         """
         columns = self.get_table_columns(table_name, schema_name, sql_conn)
         print(self.format_string(table_name + "\n" + str(columns)))
-        number_of_rows = sql_conn.read_to_df(
-            f"Select Count(*) FROM {schema_name}.{table_name}",
-        ).values[
-            0
-        ][0]
+        number_of_rows = self.get_row_count(table_name, schema_name, sql_conn)
         print(f"number of rows in {table_name}: {number_of_rows}")
         return columns
 
@@ -118,96 +147,153 @@ class Method:
             )
             raise Exception("every column cant be a value column!")
 
-        schema_created = False
+        schema_created = self.create_schema(schema_name, engine)
+        df = self.to_dataframe(input_data, column_name_list)
+        if df is None:
+            body = (
+                f"Did not recognize data structure for insert into {schema_name}.{table_name} crawler. "
+                f"Please change data structure"
+            )
+            if schema_created:
+                self.drop_schema(schema_name, sql_conn)
+            self.send_email(sql_conn, recipients, body)
+            raise Exception("DID NOT RECOGNISE INPUT: " + str(input_data))
+        self.df_to_db(
+            table_name,
+            schema_name,
+            df,
+            value_columns,
+            replace,
+            schema_created,
+            sql_conn,
+            ignore_duplicates_check,
+            crawldate_column,
+            recipients,
+        )
+
+    def create_schema(self, schema_name, engine):
+        """Creates the schema if it does not exist
+        :param schema_name: Name of schema
+        :param engine: engine used to connect to database
+        :return: True if the schema was created
+        """
         try:
             engine.execute(sal.schema.CreateSchema(schema_name), checkfirst=True)
             print("Created new schema in DB: " + schema_name)
-            schema_created = True  # solve differently??
+            return True  # solve differently??
         except:
             print("Schema " + schema_name + " exists in DB")
-        if any(isinstance(i, list) for i in input_data):  # list in list
-            df = pd.DataFrame(input_data, columns=column_name_list)
-            self.df_to_db(
-                table_name,
-                schema_name,
-                df,
-                value_columns,
-                replace,
-                schema_created,
-                sql_conn,
-                ignore_duplicates_check,
-                crawldate_column,
-                recipients,
-            )
+            return False
 
+    def to_dataframe(self, input_data, column_name_list):
+        """Turns the input of push_data into a dataframe
+        :param input_data: Data to be pushed. List in list, list, pandas.Dataframe, np.ndarray or dict
+        :param column_name_list: Used for giving correct name to data. Only required when input_data is a list
+        :return: Dataframe, or None if the data structure is not recognised
+        """
+        if any(isinstance(i, list) for i in input_data):  # list in list
+            return pd.DataFrame(input_data, columns=column_name_list)
         elif isinstance(input_data, list):  # list
             if len(column_name_list) == len(input_data):
-                df = pd.DataFrame([input_data], columns=column_name_list)  # list = row
-            else:
-                df = pd.DataFrame(input_data, columns=column_name_list)  # list = column
-            self.df_to_db(
-                table_name,
-                schema_name,
-                df,
-                value_columns,
-                replace,
-                schema_created,
-                sql_conn,
-                ignore_duplicates_check,
-                crawldate_column,
-                recipients,
-            )
-
+                return pd.DataFrame([input_data], columns=column_name_list)  # list = row
+            return pd.DataFrame(input_data, columns=column_name_list)  # list = column
         elif isinstance(input_data, pd.DataFrame):  # pandas.Dataframe
-            self.df_to_db(
-                table_name,
-                schema_name,
-                input_data,
-                value_columns,
-                replace,
-                schema_created,
-                sql_conn,
-                ignore_duplicates_check,
-                crawldate_column,
-                recipients,
-            )
+            return input_data
         elif isinstance(input_data, np.ndarray):  # np.ndarray
-            df = pd.DataFrame(input_data)
-            self.df_to_db(
-                table_name,
-                schema_name,
-                df,
-                value_columns,
-                replace,
-                schema_created,
-                sql_conn,
-                ignore_duplicates_check,
-                crawldate_column,
-                recipients,
-            )
+            return pd.DataFrame(input_data)
         elif isinstance(input_data, dict):  # dict
-            df = pd.DataFrame(input_data.items(), columns=column_name_list)
-            self.df_to_db(
-                table_name,
-                schema_name,
-                df,
-                value_columns,
-                replace,
-                schema_created,
+            return pd.DataFrame(input_data.items(), columns=column_name_list)
+        return None
+
+    def push_many(
+        self,
+        data,
+        column_name_list,
+        value_columns,
+        crawldate_column,
+        replace,
+        ignore_duplicates_check,
+        sql_conn,
+        recipients,
+        max_workers=None,
+        staged=None,
+    ):
+        """Method for pushing data to several tables in parallel, with one notification for all of them
+        :param data: dict mapping (schema name, table name) to the data to be pushed to that table
+        :param column_name_list: Used for giving correct name to data. A list for every table, or a dict keyed like data
+        :param value_columns: Columns that contains values. A list for every table, or a dict keyed like data
+        :param crawldate_column: String describing name of crawl_date column
+        :param replace: Boolean deciding if old values should be replaced if there is a identical row (except for value_columns)
+        :param ignore_duplicates_check True if you want no duplicate check to run
+        :param sql_conn: Instance of SQLConnection class
+        :param recipients string with emails that should receive the notification
+        :param max_workers: (optional) number of tables pushed at the same time. Default is the connection pool size
+        :param staged: (optional) True to merge every table through a staging table. Defaults to the staged_upload setting
+        :return Dataframe with a summary row per table
+        """
+        if not data:
+            return pd.DataFrame(columns=["schema", "table", "rows_added", "successful", "error", "seconds"])
+        engine, conn = sql_conn.get_connection()
+        # Every schema is created once, before the tables are pushed in parallel
+        for schema_name in {key[0] for key in data}:
+            self.create_schema(schema_name, engine)
+
+        def per_table(option, key):
+            return option.get(key, []) if isinstance(option, dict) else option
+
+        def push_table(key):
+            schema_name, table_name = key
+            start = time.perf_counter()
+            try:
+                if data[key] is None:
+                    raise Exception("Input_data can not be None")
+                df = self.to_dataframe(data[key], per_table(column_name_list, key))
+                if df is None:
+                    raise Exception("Did not recognize data structure")
+                table_value_columns = per_table(value_columns, key)
+                col_list = self.get_table_columns(table_name, schema_name, sql_conn)
+                if max(len(col_list), len(df.columns)) <= len(table_value_columns):
+                    raise Exception("every column cant be a value column!")
+                summary = self.df_to_db(
+                    table_name,
+                    schema_name,
+                    df,
+                    table_value_columns,
+                    replace,
+                    False,
+                    sql_conn,
+                    ignore_duplicates_check,
+                    crawldate_column,
+                    recipients,
+                    staged=staged,
+                    notify=False,
+                )
+                summary.update(successful=True, error=None)
+            except Exception as e:
+                summary = {"schema": schema_name, "table": table_name, "rows_added": 0, "successful": False, "error": str(e)}
+            summary["seconds"] = round(time.perf_counter() - start, 3)
+            return summary
+
+        # Every worker checks its connections out of the engine pool
+        workers = max_workers or min(len(data), getattr(engine.pool, "size", lambda: 5)()) or 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            summaries = pd.DataFrame(list(executor.map(push_table, data)))
+
+        text = (
+            f"{int(summaries['rows_added'].sum())} rows added to {int((summaries['rows_added'] != 0).sum())} "
+            f"of {len(summaries)} tables. {int((~summaries['successful']).sum())} pushes failed."
+        )
+        print(text)
+        if (summaries["rows_added"] != 0).any() or not summaries["successful"].all():
+            columns = ["schema", "table", "rows_added", "successful", "error", "seconds"]
+            body = text + "\n\n" + f"""{summaries[columns].to_html(index=False)}"""
+            self.send_email(
                 sql_conn,
-                ignore_duplicates_check,
-                crawldate_column,
                 recipients,
+                MIMEText(body.replace("\n", "<br>"), "html"),
+                "Crawler Error" if not summaries["successful"].all() else f"New data added to {len(summaries)} tables",
             )
-        else:
-            body = (
-                f"Did not recognize data structure for insert into {schema_name}.{table_name} crawler. "
-                f"Please change data structure"
-            )
-            if schema_created:
-                self.drop_schema(schema_name, sql_conn)
-            self.send_email(sql_conn, recipients, body)
-            raise Exception("DID NOT RECOGNISE INPUT: " + str(input_data))
+        return summaries
 
     def df_to_db(
         self,
@@ -221,6 +307,8 @@ class Method:
         ignore_duplicates_check,
         crawldate_column,
         recipients,
+        staged=None,
+        notify=True,
     ):
         """Push Data to the selected table and provide errors if they occur,
         this should also append today's date to the data as a 'Crawled Date' column
@@ -234,10 +322,13 @@ class Method:
         :param ignore_duplicates_check True if you want no duplicate check to run
         :param crawldate_column: String describing name of crawl_date column. Default is 'CrawlDate'
         :param recipients string with emails that should receive email in case of errors
+        :param staged (optional) True to merge through a staging table, so the whole push is committed at once.
+                Defaults to the staged_upload setting
+        :param notify False to skip the emails, e.g. when the caller sends one notification for several pushes
+        :return dict summarising the push: schema, table, rows before and after, rows added, new columns, upload report
         """
 
         # TODO Should the default column name be changed from CrawlDate to UploadDate?
-        col_list = []  # used for feedback to user
         if crawldate_column:
             if crawldate_column not in df:
                 df[crawldate_column] = pandas.Timestamp.now()
@@ -248,51 +339,61 @@ class Method:
         for i in range(len(df.columns)):
             if "object" in str(df.dtypes[i]):  # to avoid varchar(max)
                 varchar_cols[df.columns[i]] = sal.types.NVARCHAR(self.max_varchar)
+        # Approximate, from the partition statistics. Only used for reporting, the rows added are counted exactly
         before = self.get_row_count(table_name, schema_name, sql_conn)
+        staging = (self.staged_upload if staged is None else staged) and not ignore_duplicates_check
+        # A new table has no old rows to merge with, only the duplicates within the push are removed.
+        # Existing tables are always merged, also when empty, so the dedup never depends on a row count
+        merge = staging and len(self.get_table_columns(table_name, schema_name, sql_conn)) > 0
+        if staging and not merge:
+            key_columns = self.duplicate_key_columns([[col] for col in df.columns], value_columns)
+            df = self.deduplicate_batch(df, key_columns, replace, crawldate_column)
         try:
-            # this will fail if there is a new column
-            df.to_sql(
-                table_name,
-                schema=schema_name,
-                con=engine,
-                if_exists="append",
-                index=False,
-                dtype=varchar_cols,
-                chunksize=int(math.floor(2100 / len(df.columns))) - 1,
-                method="multi",
-            )
-        except:
-            try:
-                cols = self.get_table_columns(table_name, schema_name, sql_conn)["COLUMN_NAME"].tolist()
-                for i in range(len(df.columns.values)):
-                    if df.columns.values[i] not in cols:
-                        col_list.append(df.columns.values[i])
-                        type = self.get_dtype(df.dtypes[i])
-                        query = f"ALTER TABLE {schema_name}.{table_name} ADD [{df.columns.values[i]}] {type}"
-                        sql_conn.execute(query)
-                df.to_sql(
+            # New columns are added before any data is sent, so the frame is uploaded once
+            col_list = self.apply_schema_changes(table_name, schema_name, df, sql_conn)
+            if merge:
+                report = self.staged_merge(
                     table_name,
-                    schema=schema_name,
-                    con=engine,
-                    if_exists="append",
-                    index=False,
-                    chunksize=int(math.floor(2100 / len(df.columns))) - 1,
-                    method="multi",
+                    schema_name,
+                    df,
+                    value_columns,
+                    replace,
+                    sql_conn,
+                    crawldate_column,
+                    dtype=varchar_cols,
                 )
-            except Exception as e:
-                if schema_created:
-                    self.drop_schema(schema_name, sql_conn)
-                self.monitor_crawler(table_name, schema_name, 0, False, engine)
+            else:
+                report = bulk_loader.bulk_load(
+                    df,
+                    table_name,
+                    schema_name,
+                    engine,
+                    loaders=bulk_loader.default_loaders(dtype=varchar_cols, method="multi"),
+                    dtype=varchar_cols,
+                    adaptive=self.adaptive_batches,
+                )
+        except Exception as e:
+            if schema_created:
+                self.drop_schema(schema_name, sql_conn)
+            self.monitor_crawler(table_name, schema_name, 0, False, engine)
+            if notify:
                 self.send_email(
                     sql_conn,
                     recipients,
                     f"Adding to {schema_name}.{table_name} failed. The following error occured: " + str(e),
                 )
-                raise Exception(
-                    f"Adding to {schema_name}.{table_name} failed. The following error occured: " + str(e),
-                )
-        if not ignore_duplicates_check:
-            self.remove_duplicates(
+            raise Exception(
+                f"Adding to {schema_name}.{table_name} failed. The following error occured: " + str(e),
+            )
+        # The rows added follow from the affected-row counts of the insert and the delete, not from row counts
+        # Kept per push, upload_report is shared by pushes running in parallel
+        self.upload_report = report
+        if merge:
+            rows_added = report["inserted"] - report["deleted"]
+        else:
+            rows_added = report["rows"]
+        if not ignore_duplicates_check and not staging:
+            deleted = self.remove_duplicates(
                 table_name,
                 schema_name,
                 replace,
@@ -300,18 +401,23 @@ class Method:
                 sql_conn,
                 crawldate_column,
             )
-        after = self.get_row_count(table_name, schema_name, sql_conn)
-        self.monitor_crawler(table_name, schema_name, after - before, True, engine)
+            if deleted is None:
+                # The driver did not report the deleted rows, fall back to the row counts
+                rows_added = self.get_row_count(table_name, schema_name, sql_conn) - before
+            else:
+                rows_added -= deleted
+        after = before + rows_added
+        self.monitor_crawler(table_name, schema_name, rows_added, True, engine)
         if len(col_list) != 0:
             text = (
-                f"{after - before} rows added to: {table_name}. Before: {before} rows, after: {after} rows. Also added following new columns: "
+                f"{rows_added} rows added to: {table_name}. Before: {before} rows, after: {after} rows. Also added following new columns: "
                 + " ,".join(col_list)
             )
             print(text)
         else:
-            text = f"{after - before} rows added to: {table_name}. Before: {before} rows, after: {after} rows."
+            text = f"{rows_added} rows added to: {table_name}. Before: {before} rows, after: {after} rows."
             print(text)
-        if before != after:
+        if rows_added != 0 and notify:
             body = text + "\n\n" + f"""{df.head(50).to_html(index=False)}"""
             self.send_email(
                 sql_conn,
@@ -319,6 +425,51 @@ class Method:
                 MIMEText(body.replace("\n", "<br>"), "html"),
                 "New data added to " + table_name,
             )
+        return {
+            "schema": schema_name,
+            "table": table_name,
+            "rows_before": before,
+            "rows_after": after,
+            "rows_added": rows_added,
+            "new_columns": col_list,
+            "upload_report": report,
+        }
+
+    def plan_schema_changes(self, table_name, schema_name, df, sql_conn):
+        """Compares the columns of a dataframe with the table and returns the columns to add
+        :param table_name: Name of table
+        :param schema_name: Name of schema
+        :param df: Dataframe to be pushed to database
+        :param sql_conn: Instance of SQLConnection class
+        :return: dict with the SQL type of every column of df missing from the table. Empty if the table does not exist
+        """
+        table_columns = self.get_table_columns(table_name, schema_name, sql_conn)["COLUMN_NAME"].tolist()
+        if not table_columns:
+            return {}
+        # SQL Server column names are case-insensitive, an existing column in other casing is not added again
+        known = {str(col).casefold() for col in table_columns}
+        new_columns = [col for col in df.columns if str(col).casefold() not in known]
+        if new_columns:
+            # Make sure the columns were not added since they were cached
+            table_columns = self.get_table_columns(table_name, schema_name, sql_conn, refresh=True)["COLUMN_NAME"].tolist()
+            known = {str(col).casefold() for col in table_columns}
+            new_columns = [col for col in new_columns if str(col).casefold() not in known]
+        return {col: self.get_dtype(df[col].dtype) for col in new_columns}
+
+    def apply_schema_changes(self, table_name, schema_name, df, sql_conn):
+        """Adds the columns of a dataframe that are missing from the table, in a single ALTER TABLE statement
+        :param table_name: Name of table
+        :param schema_name: Name of schema
+        :param df: Dataframe to be pushed to database
+        :param sql_conn: Instance of SQLConnection class
+        :return: list with name of the added columns
+        """
+        new_columns = self.plan_schema_changes(table_name, schema_name, df, sql_conn)
+        if new_columns:
+            additions = ", ".join([f"[{col}] {sql_type}" for col, sql_type in new_columns.items()])
+            sql_conn.execute(f"ALTER TABLE {schema_name}.{table_name} ADD {additions}")
+            self.invalidate_table_metadata(table_name, schema_name, sql_conn)
+        return list(new_columns)
 
     def remove_duplicates(
         self,
@@ -336,6 +487,7 @@ class Method:
         :param value_columns: List with name of columns where values are
         :param sql_conn: Instance of SQLConnection class
         :param crawldate_column: String describing name of crawl_date column. Default is 'CrawlDate'
+        :return number of rows deleted, or None if the driver does not report it
         """
         if replace:
             sql_val = "Desc"
@@ -350,17 +502,131 @@ class Method:
             raise Exception("every column cant be a value column!")
         col_string = ""
         server_name, db_name = sql_conn.get_names()
-        for i in col_list:
-            if i[0] in value_columns or i[0] == "CrawlDate":
-                continue
-            else:
-                col_string += f"[{i[0]}], "
+        for col in self.duplicate_key_columns(col_list, value_columns):
+            col_string += f"[{col}], "
         params = (
             f"BEGIN WITH CTE AS (SELECT *, ROW_NUMBER() OVER"
             f" (PARTITION BY {col_string[:-2]} order by [{crawldate_column}] {sql_val})"
             f" AS RN FROM [{db_name}].[{schema_name}].[{table_name}]) DELETE FROM CTE WHERE RN<>1 END COMMIT"
         )
-        sql_conn.execute(params)
+        result = sql_conn.execute(params)
+        # The driver reports -1 when the number of deleted rows is unknown
+        return result.rowcount if result.rowcount >= 0 else None
+
+    def duplicate_key_columns(self, col_list, value_columns):
+        """Columns identifying duplicate rows: every table column apart from the value columns and CrawlDate
+        :param col_list: Table columns, as returned by get_table_columns
+        :param value_columns: List with name of columns where values are
+        :return: list with name of key columns
+        """
+        return [i[0] for i in col_list if i[0] not in value_columns and i[0] != "CrawlDate"]
+
+    def deduplicate_batch(self, df, key_columns, replace, crawldate_column="CrawlDate"):
+        """Removes duplicates within the rows of a push, like remove_duplicates does in the table
+        :param df: Dataframe to be pushed to database
+        :param key_columns: Columns identifying duplicate rows
+        :param replace: Boolean describing if the latest or the earliest crawl of a duplicate is kept
+        :param crawldate_column: String describing name of crawl_date column. Default is 'CrawlDate'
+        :return: Dataframe without duplicates
+        """
+        keys = [col for col in key_columns if col in df.columns]
+        if not keys:
+            return df
+        if crawldate_column in df.columns:
+            df = df.sort_values(crawldate_column, kind="stable")
+        return df.drop_duplicates(subset=keys, keep="last" if replace else "first").sort_index()
+
+    def staged_merge(
+        self,
+        table_name,
+        schema_name,
+        df,
+        value_columns,
+        replace,
+        sql_conn,
+        crawldate_column="CrawlDate",
+        dtype=None,
+        batch_size=bulk_loader.DEFAULT_BATCH_SIZE,
+    ):
+        """Pushes data through a staging table, deduplicating only the partitions present in the push.
+        Gives the same result as appending the data and running remove_duplicates, but the work on the
+        server scales with the pushed rows instead of the table size
+        :param table_name: Name of table
+        :param schema_name: Name of schema
+        :param df: Dataframe to be pushed to database
+        :param value_columns: List with name of columns where values are
+        :param replace: Boolean describing if old or new values are to be kept in case of duplicates
+        :param sql_conn: Instance of SQLConnection class
+        :param crawldate_column: String describing name of crawl_date column. Default is 'CrawlDate'
+        :param dtype: (optional) dict with SQL types of the staging table columns
+        :param batch_size: (optional) number of rows per batch loaded into the staging table
+        :return: upload report of the staging table load, with the number of rows inserted into and deleted from the target
+        """
+        engine, conn = sql_conn.get_connection()
+        col_list = self.get_table_columns(table_name, schema_name, sql_conn).values.tolist()
+        if len(col_list) <= len(value_columns):
+            raise Exception("every column cant be a value column!")
+        key_columns = self.duplicate_key_columns(col_list, value_columns)
+        df = self.deduplicate_batch(df, key_columns, replace, crawldate_column)
+
+        target = bulk_loader.table_spec(engine, table_name, schema_name)
+        stage_name = "##" + str(uuid.uuid4()).replace("-", "_")
+        stage = bulk_loader.table_spec(engine, stage_name)
+        columns = ", ".join([f"[{col}]" for col in df.columns])
+
+        def same_key(table, stage_alias):
+            # INTERSECT compares NULLs as equal, like PARTITION BY. Table columns missing from the push are NULL
+            stage_cols = [f"{stage_alias}.[{col}]" if col in df.columns else "NULL" for col in key_columns]
+            table_cols = [f"{table}.[{col}]" for col in key_columns]
+            return f"EXISTS (SELECT {', '.join(table_cols)} INTERSECT SELECT {', '.join(stage_cols)})"
+
+        # Pushed rows that would lose against an existing row in remove_duplicates are not inserted
+        losing = ">" if replace else "<="
+        insert = (
+            f"INSERT INTO {target} ({columns}) SELECT {columns} FROM {stage} s "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {target} t WHERE {same_key('t', 's')} "
+            f"AND t.[{crawldate_column}] {losing} s.[{crawldate_column}])"
+        )
+        # remove_duplicates, on the pushed partitions only
+        row_number = (
+            f"ROW_NUMBER() OVER (PARTITION BY {', '.join([f'[{col}]' for col in key_columns])}"
+            f" order by [{crawldate_column}] {'Desc' if replace else 'Asc'})"
+        )
+        pushed = f"EXISTS (SELECT 1 FROM {stage} s WHERE {same_key('t', 's')})"
+        if engine.dialect.name == "sqlite":
+            # SQLite cannot delete through a CTE, the losing rows are deleted by rowid
+            delete = (
+                f"DELETE FROM {target} WHERE rowid IN (SELECT rid FROM"
+                f" (SELECT t.rowid AS rid, {row_number} AS RN FROM {target} t WHERE {pushed}) WHERE RN<>1)"
+            )
+        else:
+            delete = f"WITH CTE AS (SELECT *, {row_number} AS RN FROM {target} t WHERE {pushed}) DELETE FROM CTE WHERE RN<>1"
+
+        # The staging table only lives as long as its session, so every step uses the same connection, in one
+        # transaction also on AUTOCOMMIT engines. A failed loader rolls back to its savepoint before the next one
+        with bulk_loader.connect(engine) as connection:
+            try:
+                with connection.begin():
+                    report = bulk_loader.bulk_load(
+                        df,
+                        stage_name,
+                        None,
+                        connection,
+                        loaders=bulk_loader.default_loaders(dtype=dtype, method="multi"),
+                        batch_size=batch_size,
+                        dtype=dtype,
+                        adaptive=self.adaptive_batches,
+                    )
+                    report["inserted"] = connection.exec_driver_sql(insert).rowcount
+                    report["deleted"] = connection.exec_driver_sql(delete).rowcount
+            finally:
+                # A global temporary table is visible to every session until it is dropped, also after a failure
+                try:
+                    with connection.begin():
+                        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {stage}")
+                except Exception as e:
+                    print(f"Could not drop staging table {stage}: {e}")
+        return report
 
     def get_dtype(self, pandas_type):
         """Method used for finding correct type
@@ -398,63 +664,55 @@ class Method:
         for i in range(len(df)):
             sql_conn.execute(f"DROP TABLE [{schema_name}].[{df.values[i][0]}]")
         sql_conn.execute(f"DROP SCHEMA [{schema_name}]")
+        self.invalidate_table_metadata(None, schema_name, sql_conn)
         print(f"{schema_name} and subtables has been dropped")
 
     def monitor_crawler(self, table_name, schema_name, nr_of_lines, successful, engine):
-        """Method for running the monitoring table
+        """Method for running the monitoring table. The record is buffered and written to Info.MonitoringTable
+        in batches by a background thread, and at process exit
         :param table_name: Name of table
         :param schema_name: Name of schema
         :param nr_of_lines number of lines added
         :param successful if upload was successful or not
         :param engine engine used to connect to database
         """
-        try:
-            engine.execute(sal.schema.CreateSchema("Info"), checkfirst=True)
-            print("Info-Schema created")
-        except:
-            print("updating monitoring table...")
-        col_dtypes = {
-            "Table": sal.types.NVARCHAR(255),
-            "Schema": sal.types.NVARCHAR(255),
-            "Nr_of_rows": sal.types.INT(),
-            "Timestamp": sal.types.DateTime(),
-        }
-        df = pd.DataFrame(
-            [
-                [
-                    schema_name,
-                    table_name,
-                    nr_of_lines,
-                    successful,
-                    pd.pandas.Timestamp.now(),
-                ],
-            ],
-            columns=["Schema", "Table", "Nr_of_rows", "Upload successful", "Timestamp"],
-        )
-        df.to_sql(
-            "MonitoringTable",
-            schema="Info",
-            con=engine,
-            if_exists="append",
-            index=False,
-            dtype=col_dtypes,
-        )
+        monitoring.get_sink(engine).record(schema_name, table_name, nr_of_lines, successful)
+
+    def flush_monitoring(self, sql_conn):
+        """Writes the buffered monitoring records to the database now
+        :param sql_conn: Instance of SQLConnection class
+        :return number of records written
+        """
+        engine, conn = sql_conn.get_connection()
+        return monitoring.get_sink(engine).flush()
 
     def get_row_count(self, table_name, schema_name, sql_conn):
-        """Method for getting row count
+        """Method for getting row count, from the partition statistics instead of a COUNT(*) scan
         :param table_name: Name of table
         :param schema_name: Name of schema
         :param sql_conn: Instance of SQLConnection class
         :return number of lines in table
         """
-        # this might later be replaced by count=df.to_sql(). Not a current feature, but talks of implementing it.
+        try:
+            df = sql_conn.read_to_df(
+                "SELECT SUM(row_count) FROM sys.dm_db_partition_stats "
+                f"WHERE object_id = OBJECT_ID('[{schema_name}].[{table_name}]') AND index_id IN (0, 1)",
+            )
+            count = df.values[0][0]
+            return 0 if pd.isna(count) else int(count)
+        except:
+            # Reading the partition statistics needs VIEW DATABASE STATE
+            pass
         try:
             df = sql_conn.read_to_df(
                 f"SELECT COUNT(*) FROM [{schema_name}].[{table_name}]",
             )
             return int(df.values[0][0])
-        except:
-            return 0
+        except Exception:
+            # A table that does not exist yet has no rows, any other failure is not taken for an empty table
+            if len(self.get_table_columns(table_name, schema_name, sql_conn, refresh=True)) == 0:
+                return 0
+            raise
 
     def send_email(self, sql_conn, recipients, body, subject="Crawler Error"):
         """:param sql_conn: Instance of SQLConnection class
@@ -485,6 +743,14 @@ class Method:
         else:
             self.max_varchar = varchar_size
 
+    def set_adaptive_batches(self, adaptive):
+        """:param adaptive True to tune upload batch sizes to the measured throughput"""
+        self.adaptive_batches = bool(adaptive)
+
+    def set_staged_upload(self, staged):
+        """:param staged True to merge pushes through a staging table instead of appending and deduplicating the whole table"""
+        self.staged_upload = bool(staged)
+
     def get_newest_date(self, table_name, schema_name, col_name, sql_conn):
         """Method for getting the newest date present
         :param table_name: Name of table
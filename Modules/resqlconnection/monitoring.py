@@ -0,0 +1,212 @@
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+import sqlalchemy as sal
+
+"""
+Buffered writes to the Info.MonitoringTable, so monitoring does not cost a round trip per push
+"""
+
+MONITORING_SCHEMA = "Info"
+MONITORING_TABLE = "MonitoringTable"
+MONITORING_COLUMNS = ["Schema", "Table", "Nr_of_rows", "Upload successful", "Timestamp"]
+# Records that could not be written to the database are kept here until the next successful flush, in one
+# SQLite file per database so a sink never flushes records of another database
+FALLBACK_DIR = os.getenv("RESQL_MONITORING_FALLBACK_DIR", ".monitoring_fallback")
+
+# One sink per engine, flushed at process exit
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+def default_fallback_path(engine):
+    """
+    Returns the fallback file of an engine, named after a hash of its URL
+    :param engine: engine of the database holding the monitoring table
+    :return: path of the SQLite file in FALLBACK_DIR
+    """
+    url = engine.url.render_as_string(hide_password=True)
+    return os.path.join(FALLBACK_DIR, hashlib.blake2b(url.encode("utf-8"), digest_size=16).hexdigest() + ".db")
+
+
+class MonitoringSink:
+    """Buffers monitoring records in memory and writes them to the database in batches"""
+
+    def __init__(self, engine, flush_interval=5.0, max_buffer=500, fallback_path=None):
+        """
+        :param engine: engine of the database holding the monitoring table
+        :param flush_interval: seconds between background flushes
+        :param max_buffer: number of buffered records that triggers a flush before the interval is over
+        :param fallback_path: SQLite file for records the database does not accept. Default is the engine's file in FALLBACK_DIR
+        """
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.fallback_path = fallback_path or default_fallback_path(engine)
+        self.schema_checked = False
+        self._records = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def record(self, schema_name, table_name, nr_of_lines, successful):
+        """Buffers a monitoring record. Returns immediately, the record is written by the background thread
+        :param schema_name: Name of schema
+        :param table_name: Name of table
+        :param nr_of_lines: number of lines added
+        :param successful: if upload was successful or not
+        """
+        with self._lock:
+            self._records.append([schema_name, table_name, nr_of_lines, successful, pd.Timestamp.now()])
+            full = len(self._records) >= self.max_buffer
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="monitoring-sink", daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # The thread is the only background flush of the sink, a failed flush must not end it
+                print(f"Monitoring flush failed: {e}")
+
+    def _ensure_schema(self):
+        # Checked once per process instead of failing a CREATE SCHEMA on every push
+        if self.schema_checked:
+            return
+        if MONITORING_SCHEMA not in sal.inspect(self.engine).get_schema_names():
+            with self.engine.begin() as conn:
+                conn.execute(sal.schema.CreateSchema(MONITORING_SCHEMA))
+            print("Info-Schema created")
+        self.schema_checked = True
+
+    def _write(self, df):
+        col_dtypes = {
+            "Table": sal.types.NVARCHAR(255),
+            "Schema": sal.types.NVARCHAR(255),
+            "Nr_of_rows": sal.types.INT(),
+            "Timestamp": sal.types.DateTime(),
+        }
+        df.to_sql(
+            MONITORING_TABLE,
+            schema=MONITORING_SCHEMA,
+            con=self.engine,
+            if_exists="append",
+            index=False,
+            dtype=col_dtypes,
+        )
+
+    def _read_fallback(self):
+        # The rowid of every record is kept in a _rowid column, so only the records read are deleted
+        if not os.path.exists(self.fallback_path):
+            return None
+        conn = sqlite3.connect(self.fallback_path, timeout=30)
+        try:
+            return pd.read_sql_query(
+                f"SELECT rowid AS _rowid, * FROM [{MONITORING_TABLE}]",
+                conn,
+                parse_dates=["Timestamp"],
+            )
+        except (sqlite3.Error, pd.errors.DatabaseError) as e:
+            # The file is left as it is, so the records in it can still be recovered by hand
+            print(f"Monitoring fallback {self.fallback_path} not readable, its records are not flushed: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def _delete_fallback(self, rowids):
+        # In one transaction, and by rowid, so records other processes appended since the read are kept
+        conn = sqlite3.connect(self.fallback_path, timeout=30)
+        try:
+            with conn:
+                conn.executemany(f"DELETE FROM [{MONITORING_TABLE}] WHERE rowid = ?", [(rowid,) for rowid in rowids])
+        finally:
+            conn.close()
+
+    def _write_fallback(self, df):
+        os.makedirs(os.path.dirname(self.fallback_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.fallback_path, timeout=30)
+        try:
+            df.assign(Timestamp=df["Timestamp"].astype(str)).to_sql(
+                MONITORING_TABLE,
+                conn,
+                if_exists="append",
+                index=False,
+            )
+        finally:
+            conn.close()
+
+    def flush(self):
+        """Writes the buffered records, and the records kept in the fallback file, to the database in one batch.
+        If the database cannot be reached, the records are kept in the SQLite fallback file instead
+        :return: number of records written to the database
+        """
+        with self._flush_lock:
+            with self._lock:
+                records, self._records = self._records, []
+            new = pd.DataFrame(records, columns=MONITORING_COLUMNS)
+            pending = self._read_fallback()
+            rowids = pending.pop("_rowid").tolist() if pending is not None else []
+            df = new
+            if pending is not None and len(pending) > 0:
+                df = pd.concat([pending, new], ignore_index=True) if len(new) > 0 else pending
+            if len(df) == 0:
+                return 0
+            try:
+                self._ensure_schema()
+                self._write(df)
+            except Exception as e:
+                if len(new) > 0:
+                    # Only the new records are appended, the pending ones are still in the file
+                    try:
+                        self._write_fallback(new)
+                    except Exception:
+                        with self._lock:
+                            self._records = records + self._records
+                        print(f"Monitoring table not reachable, {len(new)} records kept in memory: {e}")
+                        return 0
+                print(f"Monitoring table not reachable, {len(df)} records kept in {self.fallback_path}: {e}")
+                return 0
+            if rowids:
+                self._delete_fallback(rowids)
+            return len(df)
+
+    def close(self):
+        """Stops the background thread and flushes the remaining records"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 30)
+        self.flush()
+
+
+def get_sink(engine):
+    """
+    Returns the process-wide monitoring sink of an engine
+    :param engine: engine of the database holding the monitoring table
+    :return: MonitoringSink
+    """
+    with _sinks_lock:
+        if engine not in _sinks:
+            _sinks[engine] = MonitoringSink(engine)
+        return _sinks[engine]
+
+
+@atexit.register
+def flush_all():
+    """Flushes the monitoring records of every sink. Runs at process exit"""
+    with _sinks_lock:
+        sinks = list(_sinks.values())
+    for sink in sinks:
+        sink.close()
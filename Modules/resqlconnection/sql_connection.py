@@ -2,6 +2,8 @@ import pandas as pd
 import pyodbc
 import sqlalchemy
 
+from . import arrow_fetch
+
 """
 Created 05.07.2021
 r
@@ -81,6 +83,25 @@ class SQLConnection:
         df = pd.DataFrame(sql_result)
         return df
 
+    def read_to_df_chunks(self, sql_statement, chunksize=100000):
+        """
+        Method for reading from database in chunks, streaming the result from a server-side cursor
+        :param sql_statement: SQL statement to be executed
+        :param chunksize: number of rows per chunk
+        :return: generator of pandas.Dataframe with at most chunksize rows each
+        """
+        with self.engine.connect().execution_options(stream_results=True) as connection:
+            yield from pd.read_sql_query(sql_statement, connection, chunksize=chunksize)
+
+    def read_to_arrow(self, sql_statement, schema=None):
+        """
+        Method for reading from database straight to Arrow, without pandas object columns
+        :param sql_statement: SQL statement to be executed
+        :param schema: (optional) pyarrow.Schema declaring the result types
+        :return: pyarrow.Table with information from sql statement
+        """
+        return arrow_fetch.fetch_arrow(self.engine, sql_statement, schema)
+
     def get_connection(self):
         """
         Method for getting connection
@@ -3,12 +3,17 @@
 import json
 import logging
 import os
+import sqlite3
+import uuid
 from datetime import datetime
 
 import pandas as pd
 
-from Modules import send_email
-from Modules.connect_to_sql import MySqlConnection
+from Modules import frame_diff, send_email, watermark_store
+from Modules.connect_to_sql import MySqlConnection, merge_statement
+
+# Column dtypes of the target tables, keyed on (server, database, schema, table)
+_table_dtypes = {}
 
 
 class SqlCompareTools:
@@ -37,15 +42,63 @@ class SqlCompareTools:
             sql_params["server_name"],
             sql_params["database_name"],
         )
+        # Opened on first use, see _watermark_store
+        self._watermarks = None
         pass
 
-    def get_last_date(self, table_name=""):
+    def _table_key(self, table_name=""):
+        return (
+            self.sql_params["server_name"],
+            self.sql_params["database_name"],
+            self.sql_params["schema_name"],
+            table_name or self.sql_params["table_name"],
+        )
+
+    def _watermark_store(self, create=True):
+        """Opens the local watermark store on first use.
+
+        Returns None if the store cannot be opened (e.g. in a read-only working directory),
+        or if it does not exist yet and `create` is false. The last dates are then read
+        from the server.
+        """
+        if self._watermarks is None and (create or os.path.exists(watermark_store.WATERMARK_DB)):
+            try:
+                self._watermarks = watermark_store.WatermarkStore()
+            except (OSError, sqlite3.Error) as e:
+                self.logger.warning(f"Watermark store not available, last dates are read from the server: {e}")
+                self._watermarks = False
+        return self._watermarks or None
+
+    def _update_watermark(self, action, key, *args):
+        """Runs `action` ("set", "advance" or "clear") on a stored watermark.
+
+        Nothing is created for this: a store that does not exist holds no watermark to
+        update. Failures are logged, the server stays the source of truth.
+        """
+        store = self._watermark_store(create=False)
+        if store is None:
+            return
+        try:
+            getattr(store, action)(key, *args)
+        except sqlite3.Error as e:
+            self.logger.warning(f"Could not {action} the watermark of {key[2]}.{key[3]}: {e}")
+
+    def get_last_date(self, table_name="", use_watermark=False, max_age=watermark_store.WATERMARK_MAX_AGE):
         """Gets the most recent date from the Date column.
 
+        By default the date is queried from the server. With `use_watermark`, the date
+        kept as the table watermark in the local watermark store is used instead, while it
+        is younger than `max_age`. Uploads made through this class move the watermark
+        forward, uploads made elsewhere are only picked up once it is older than `max_age`.
+
         Parameters
         ----------
         table_name : str (optional)
             Table to get last date from. If not populated, it will use the sql_params table name.
+        use_watermark : bool = False
+            If true, a stored watermark is returned without querying the server.
+        max_age : timedelta = WATERMARK_MAX_AGE
+            Maximum age of a stored watermark. If None, a stored watermark is always used.
 
         Returns
         -------
@@ -55,29 +108,94 @@ class SqlCompareTools:
         """
 
         table = table_name if table_name != "" else self.sql_params["table_name"]
+        key = self._table_key(table)
+        store = self._watermark_store() if use_watermark else None
+        if store is not None:
+            try:
+                watermark = store.get(key, max_age)
+            except sqlite3.Error as e:
+                self.logger.warning(f"Could not read the watermark of {table}: {e}")
+                watermark = None
+            if watermark is not None:
+                return watermark
 
         query = f"""
-        SELECT	TOP (1)
-            [Date]
+        SELECT	MAX([Date])
         FROM	[{self.sql_params["database_name"]}].[{self.sql_params["schema_name"]}].[{table}]
-        ORDER BY
-            DATE DESC
         """
 
         last_date = self.sql_obj.sql_to_df(query)
-        if len(last_date) > 0:
-            timestamp = last_date.iloc[0, 0]
-            return timestamp.to_pydatetime()
+        if len(last_date) > 0 and pd.notna(last_date.iloc[0, 0]):
+            timestamp = pd.Timestamp(last_date.iloc[0, 0]).to_pydatetime()
+            if use_watermark:
+                self._update_watermark("set", key, timestamp)
+            return timestamp
         return 0
 
-    def get_old_data(
+    def _advance_watermark(self, df, date_column="Date"):
+        """Moves the table watermark forward to the last date of rows just written."""
+        if date_column in df.columns and len(df.index) > 0:
+            last_date = pd.to_datetime(df[date_column]).max()
+            if pd.notna(last_date):
+                self._update_watermark("advance", self._table_key(), last_date.to_pydatetime())
+
+    def get_table_dtypes(self):
+        """Gets the column dtypes of the target table, querying them once per process.
+
+        Returns
+        -------
+        Series
+            pandas dtypes of the table columns, indexed by column name.
+
+        """
+        key = self._table_key()
+        if key in _table_dtypes:
+            return _table_dtypes[key]
+
+        df_source = self.sql_obj.sql_to_df(
+            f"select top 1 * from {self.sql_params['schema_name']}.{self.sql_params['table_name']}",
+        )
+        # An empty table only reports object columns, so its dtypes are not cached
+        if len(df_source) > 0:
+            _table_dtypes[key] = df_source.dtypes
+        return df_source.dtypes
+
+    def to_source_types(self, df_new, keep_first_col=False):
+        """Keeps the columns of the target table in `df_new` and casts them to the table dtypes.
+
+        Parameters
+        ----------
+        df_new : DataFrame
+            DataFrame with the data gathered by the crawler.
+        keep_first_col : bool = False
+            If true, will keep the first column of the table (usually the identity column).
+
+        Returns
+        -------
+        DataFrame
+            The table columns of `df_new`, with the table dtypes.
+
+        """
+        # Source table columns and dtypes, cached after the first call
+        source_dtypes = self.get_table_dtypes()
+        datatypes = source_dtypes if keep_first_col else source_dtypes[1:]
+        return df_new[datatypes.index].astype(datatypes)
+
+    def get_old_data(  # noqa: PLR0913
         self,
         partition_by_columns: "list[str]",
         value_column_name="Value",
         date: datetime = None,
+        start_date: datetime = None,
+        end_date: datetime = None,
+        date_column="Date",
     ):
         """Gets the already existing data from the database to do the comparison with the new data.
 
+        When `date_column` is one of the partition columns, the date filters are applied
+        inside the ROW_NUMBER window, so the server only ranks the rows of the selected
+        dates instead of the whole table.
+
         Parameters
         ----------
         partition_by_columns : list[str]
@@ -86,6 +204,12 @@ class SqlCompareTools:
             Column used to store the values.
         date : datetime = None
             (optional) If added, will filter the query by dates after this.
+        start_date : datetime = None
+            (optional) If added, will filter the query by dates from this one on.
+        end_date : datetime = None
+            (optional) If added, will filter the query by dates up to this one.
+        date_column : str = "Date"
+            Column the date filters apply to.
 
         Returns
         -------
@@ -94,6 +218,18 @@ class SqlCompareTools:
 
         """
 
+        conditions = []
+        if date:
+            conditions.append(f"[{date_column}] > '" + date.strftime("%Y%m%d") + "'")
+        if start_date:
+            conditions.append(f"[{date_column}] >= '" + start_date.strftime("%Y%m%d") + "'")
+        if end_date:
+            conditions.append(f"[{date_column}] <= '" + end_date.strftime("%Y%m%d %H:%M:%S") + "'")
+
+        # Filtering whole partitions before ranking them keeps the same first rows
+        inner_conditions = conditions if date_column in partition_by_columns else []
+        outer_conditions = [] if inner_conditions else conditions
+
         query = f"""
         SELECT
             {", ".join([f'[{col}]' for col in partition_by_columns])}, [{value_column_name}] AS 'old_{value_column_name}'
@@ -106,17 +242,58 @@ class SqlCompareTools:
                                         [CrawlDate]
                             ) rn
             FROM	[{self.sql_params["database_name"]}].[{self.sql_params["schema_name"]}].[{self.sql_params["table_name"]}]
+            {"WHERE " + " AND ".join(inner_conditions) if inner_conditions else ""}
         ) X
         WHERE
             rn = 1
         """
 
-        if date:
-            query = query + " AND [DATE] > '" + date.strftime("%Y%m%d") + "'"
+        for condition in outer_conditions:
+            query = query + " AND " + condition
 
         df_old = self.sql_obj.sql_to_df(query)
         return df_old
 
+    def get_incremental_old_data(
+        self,
+        df_new: pd.DataFrame,
+        partition_by_columns: "list[str]",
+        value_column_name="Value",
+        date_column="Date",
+    ):
+        """Gets the existing data of only the dates present in the new crawl.
+
+        Daily jobs compare a few days of crawled data, so only those days of the table
+        are read and ranked, instead of its whole history.
+
+        Parameters
+        ----------
+        df_new : DataFrame
+            DataFrame with the data gathered by the crawler.
+        partition_by_columns : list[str]
+            Columns that will be used in the PARTITION BY clause. Should include `date_column`.
+        value_column_name : str = "Value"
+            Column used to store the values.
+        date_column : str = "Date"
+            Date column of the table and of `df_new`.
+
+        Returns
+        -------
+        DataFrame
+            Table with old values, for the dates of `df_new`.
+
+        """
+        dates = pd.to_datetime(df_new[date_column])
+        if date_column not in partition_by_columns:
+            self.logger.warning(f"{date_column} is not a partition column, the whole table is ranked")
+        return self.get_old_data(
+            partition_by_columns,
+            value_column_name,
+            start_date=dates.min().to_pydatetime(),
+            end_date=dates.max().to_pydatetime(),
+            date_column=date_column,
+        )
+
     def compare_and_upload(  # noqa: PLR0913
         self,
         df_new: pd.DataFrame,
@@ -151,32 +328,18 @@ class SqlCompareTools:
             c for c in df_old.columns if new_column_name not in c
         ]  # take every column to join apart from the column with the unit
 
-        # Get source table information
-        df_source = self.sql_obj.sql_to_df(
-            f"select top 1 * from {self.sql_params['schema_name']}.{self.sql_params['table_name']}",
-        )  # it selects 1 raw of values, not sure why I need it?
-
-        # Define columns to keep
-        if keep_first_col:
-            cols2keep = df_source.columns
-            datatypes = df_source.dtypes
-        else:
-            cols2keep = df_source.columns[1:]
-            datatypes = df_source.dtypes[1:]
-
-        # Define source table data types
-        df_tmp = df_new[cols2keep].astype(datatypes)
+        df_tmp = self.to_source_types(df_new, keep_first_col)
+        cols2keep = df_tmp.columns
 
-        # Merge and compare new and old
-        df_final = pd.merge(
+        # Keep the rows that are new or whose value changed at 3 decimals, matched on integer key codes
+        df_final = frame_diff.changed_rows(
             df_tmp,
             df_old,
-            on=cols2join,
-            how="left",
-        )  # so the column that is gonna show up on the right will be the old_org_value column
-        df_final = df_final.loc[
-            df_final[new_column_name].astype(float).round(3) != df_final[old_column_name].astype(float).round(3)
-        ].reset_index(drop=True)
+            cols2join,
+            new_value_column=new_column_name,
+            old_value_column=old_column_name,
+            decimals=3,
+        )
 
         # Upload to sql if new data present
         if len(df_final) > 0:
@@ -199,6 +362,7 @@ class SqlCompareTools:
                     self.sql_params["schema_name"],
                     cols_to_compare,
                 )
+            self._advance_watermark(df_final)
 
             # logging and email
             self.logger.info(f"{len(df_final.index)} data points written to sql")
@@ -212,6 +376,129 @@ class SqlCompareTools:
         else:
             self.logger.info("No new data")
 
+    def compare_and_upload_on_server(  # noqa: PLR0913
+        self,
+        df_new: pd.DataFrame,
+        partition_by_columns: "list[str]",
+        value_column_name="Value",
+        keep_first_col=False,
+        cols_to_compare: "list[str]" = None,
+        should_send_email=True,
+    ):
+        """Compares the new data with the existing data on the server, and writes the new and changed rows there.
+
+        Does the same as `get_old_data` followed by `compare_and_upload`, but without
+        downloading the existing data: the new rows are uploaded to a temporary table,
+        the server keeps those that are new or whose value changed at 3 decimals, and
+        only their count and a sample for the email come back. The work and transfer
+        scale with the size of `df_new` instead of the size of the table.
+
+        Parameters
+        ----------
+        df_new : DataFrame
+            DataFrame with the data gathered by the crawler.
+        partition_by_columns : list[str]
+            Columns identifying a data point, as for `get_old_data`.
+        value_column_name : str = "Value"
+            Column used to store the values.
+        keep_first_col : bool = False
+            If true, will keep the first column when comparing both tables.
+        cols_to_compare : list[str] = None
+            List of columns to use in comparison during upsert. If populated, the rows are merged into the table instead of inserted.
+        should_send_email : bool = True
+            If true, will send an email with part of the data uploaded.
+
+        Returns
+        -------
+        int
+            Number of new and changed rows written to the table.
+
+        """
+        df_tmp = self.to_source_types(df_new, keep_first_col)
+        columns = [f"[{col}]" for col in df_tmp.columns]
+        keys = ", ".join([f"[{col}]" for col in partition_by_columns])
+        value = f"[{value_column_name}]"
+        old_column_name = f"old_{value_column_name}"
+        target = (
+            f"[{self.sql_params['database_name']}].[{self.sql_params['schema_name']}].[{self.sql_params['table_name']}]"
+        )
+
+        new_table = "##" + str(uuid.uuid4()).replace("-", "_")
+        delta_table = new_table + "_delta"
+
+        def same_key(left, right):
+            # INTERSECT compares NULLs as equal, like the key matching in pandas
+            return (
+                f"EXISTS (SELECT {', '.join([f'{left}.[{col}]' for col in partition_by_columns])} "
+                f"INTERSECT SELECT {', '.join([f'{right}.[{col}]' for col in partition_by_columns])})"
+            )
+
+        # Only the history of the keys being uploaded is read, first crawl of every key like get_old_data
+        delta_query = f"""
+        SELECT
+            n.*, o.[{old_column_name}]
+        INTO	{delta_table}
+        FROM	{new_table} n
+        LEFT JOIN (
+            SELECT
+                {keys}, {value} AS [{old_column_name}]
+            FROM	(
+                SELECT
+                    t.*
+                    ,ROW_NUMBER() OVER (PARTITION BY
+                                            {", ".join([f't.[{col}]' for col in partition_by_columns])}
+                                        ORDER BY
+                                            t.[CrawlDate]
+                                ) rn
+                FROM	{target} t
+                WHERE	EXISTS (SELECT 1 FROM {new_table} k WHERE {same_key("k", "t")})
+            ) X
+            WHERE
+                rn = 1
+        ) o ON {same_key("n", "o")}
+        WHERE
+            n.{value} IS NULL
+            OR o.[{old_column_name}] IS NULL
+            OR ROUND(CAST(n.{value} AS float), 3) <> ROUND(CAST(o.[{old_column_name}] AS float), 3)
+        """
+
+        if cols_to_compare is None or len(cols_to_compare) == 0:
+            write_query = f"INSERT INTO {target} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM {delta_table}"
+        else:
+            write_query = merge_statement(target, delta_table, list(df_tmp.columns), cols_to_compare)
+
+        with self.sql_obj.connection_engine.begin() as conn:
+            df_tmp.to_sql(new_table, conn, index=False, chunksize=20000)
+            conn.exec_driver_sql(delta_query)
+            last_date = "MAX([Date])" if "Date" in df_tmp.columns else "NULL"
+            delta_count, last_date = conn.exec_driver_sql(f"SELECT COUNT(*), {last_date} FROM {delta_table}").one()
+            if delta_count > 0:
+                # Only attach top 50 changes to an email
+                df2send = pd.read_sql_query(
+                    f"SELECT TOP 50 {keys}, [{old_column_name}], {value} FROM {delta_table}",
+                    conn,
+                )
+                conn.exec_driver_sql(write_query)
+            conn.exec_driver_sql(f"DROP TABLE IF EXISTS {delta_table}")
+            conn.exec_driver_sql(f"DROP TABLE IF EXISTS {new_table}")
+
+        if last_date is not None:
+            self._advance_watermark(pd.DataFrame({"Date": [last_date]}))
+
+        # logging and email
+        if delta_count > 0:
+            self.logger.info(f"{delta_count} data points written to sql")
+            if os.getenv("SEND_EMAIL") == "True" and should_send_email:
+                send_email.new_benchmark(
+                    df2send,
+                    fundamental=self.data_params["fundamental"],
+                    country=self.data_params["country"],
+                    to_emails=json.loads(os.getenv("EMAILS")),
+                )
+        else:
+            self.logger.info("No new data")
+        return delta_count
+
     def upsert(self, table: pd.DataFrame, match_columns: "list[str]") -> None:
         """Directly upserts data in a selected table, without doing the numbers comparison. Useful for data not based on numbers (ex. locations).
 
@@ -235,6 +522,7 @@ class SqlCompareTools:
             self.sql_params["schema_name"],
             match_columns,
         )
+        self._advance_watermark(table)
 
         table_len_df = self.sql_obj.sql_to_df(
             f'SELECT COUNT(*) FROM {self.sql_params["schema_name"]}.{self.sql_params["table_name"]}',
@@ -267,8 +555,12 @@ class SqlCompareTools:
 
         self.logger.info("Truncating database...")
         self.sql_obj.truncate_table(self.sql_params["table_name"], self.sql_params["schema_name"])
+        self._update_watermark("clear", self._table_key())
         self.logger.info("Uploading data...")
         self.sql_obj.df_to_sql(table, self.sql_params["table_name"], self.sql_params["schema_name"])
+        # The table now holds exactly these rows, so their last date is the watermark
+        if "Date" in table.columns and pd.notna(pd.to_datetime(table["Date"]).max()):
+            self._update_watermark("set", self._table_key(), pd.to_datetime(table["Date"]).max().to_pydatetime())
 
         # Only attach top 50 changes to an email
         df2send = table.head(50)
@@ -295,6 +587,7 @@ class SqlCompareTools:
 
         self.logger.info("Uploading data...")
         self.sql_obj.df_to_sql(table, self.sql_params["table_name"], self.sql_params["schema_name"])
+        self._advance_watermark(table)
 
         # Only attach top 50 changes to an email
         df2send = table.head(50)
@@ -0,0 +1,744 @@
+"""Loading helpers for the gas storage dataset used by the dashboard."""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+logger = logging.getLogger(__name__)
+
+# Target dtype of every column kept from Storage.csv. Numbers are only stored as
+# float32 if they survive the round trip to FLOAT32_DECIMALS decimals.
+STORAGE_SCHEMA = {
+    "status": "category",
+    "gasInStorage": "float32",
+    "full": "float32",
+    "trend": "float32",
+    "injection": "float32",
+    "withdrawal": "float32",
+    "workingGasVolume": "float32",
+    "injectionCapacity": "float32",
+    "withdrawalCapacity": "float32",
+    "Name": "category",
+    "Country": "category",
+    "Type": "category",
+    "operator": "category",
+    "Date": "datetime64[ns]",
+    "LastUpdateTime": "datetime64[ns]",
+}
+FLOAT32_DECIMALS = 4
+
+# Redundant with Date, dropped on load. Use `date_parts` to derive them again.
+DERIVED_DATE_COLS = ["Year", "Month", "Day", "Week"]
+
+CUBE_MEASURES = ["gasInStorage", "full", "injection", "withdrawal", "workingGasVolume"]
+
+FACILITY_KEYS = ["Name", "Country"]
+
+CACHE_SUFFIX = ".arrow"
+CACHE_META_SUFFIX = ".arrow.json"
+# Bump whenever convert_storage_types changes, so caches written by older code are rebuilt
+CACHE_VERSION = 3
+
+
+def read_storage_csv(path):
+    """Reads the raw storage CSV, falling back to latin1 if the file is not valid utf-8.
+
+    Parameters
+    ----------
+    path : str
+        Path to the storage CSV.
+
+    Returns
+    -------
+    DataFrame
+        Untyped storage data, as parsed by pandas.
+
+    """
+    try:
+        return pd.read_csv(path, encoding="utf-8")
+    except UnicodeDecodeError:
+        return pd.read_csv(path, encoding="latin1")
+
+
+def frame_memory_mb(df):
+    """Returns the memory used by a DataFrame in MB, including the string payloads."""
+    return df.memory_usage(deep=True).sum() / 1024**2
+
+
+def downcast_float(values, decimals=FLOAT32_DECIMALS):
+    """Converts values to float32 if no value moves by more than half a unit of `decimals`.
+
+    Parameters
+    ----------
+    values : Series
+        Numerical values.
+    decimals : int = FLOAT32_DECIMALS
+        Number of decimals that must be preserved.
+
+    Returns
+    -------
+    Series
+        float32 values if precision allows, float64 otherwise.
+
+    """
+    values = values.astype("float64")
+    as_float32 = values.astype("float32")
+    error = (as_float32.astype("float64") - values).abs()
+    if (error.isna() | (error < 0.5 * 10**-decimals)).all():
+        return as_float32
+    return values
+
+
+def convert_storage_types(df):
+    """Applies STORAGE_SCHEMA to the raw storage data and reports the memory saved.
+
+    The low-cardinality strings become categoricals, the numbers are downcast to float32
+    where precision allows and the redundant Year/Month/Day/Week columns are dropped.
+    The rows are sorted by Date, so date ranges can be sliced with a binary search.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Storage data as returned by `read_storage_csv`.
+
+    Returns
+    -------
+    DataFrame
+        The frame with typed columns.
+
+    """
+    # Measuring object columns walks every string, so only do it when the report is logged
+    report_memory = logger.isEnabledFor(logging.INFO)
+    memory_before = frame_memory_mb(df) if report_memory else None
+
+    df = df.drop(columns=[col for col in DERIVED_DATE_COLS if col in df.columns])
+    for col, dtype in STORAGE_SCHEMA.items():
+        if col not in df.columns:
+            continue
+        if dtype.startswith("datetime"):
+            df[col] = pd.to_datetime(df[col])
+        elif dtype == "category":
+            df[col] = df[col].astype("category")
+        else:
+            df[col] = downcast_float(pd.to_numeric(df[col], errors="coerce"))
+    if not df["Date"].is_monotonic_increasing:
+        df = df.sort_values("Date", kind="stable", ignore_index=True)
+
+    if report_memory:
+        logger.info(
+            "Storage data typed: %.2f MB -> %.2f MB (%d rows)",
+            memory_before,
+            frame_memory_mb(df),
+            len(df),
+        )
+    return df
+
+
+def date_parts(df):
+    """Derives the Year, Month, Day and ISO Week columns dropped from Storage.csv."""
+    dates = df["Date"].dt
+    return pd.DataFrame(
+        {
+            "Year": dates.year,
+            "Month": dates.month,
+            "Day": dates.day,
+            "Week": dates.isocalendar().week,
+        },
+        index=df.index,
+    )
+
+
+def read_storage_csv_tail(path, offset, names):
+    """Reads the complete lines appended to the storage CSV after byte `offset`.
+
+    A trailing line without a newline may still be being written, so it is left for the
+    next read.
+
+    Parameters
+    ----------
+    path : str
+        Path to the storage CSV.
+    offset : int
+        Byte offset where the unread part starts. Must be at the start of a line.
+    names : list[str]
+        Column names, as found in the header of the file.
+
+    Returns
+    -------
+    tuple[DataFrame, int]
+        Untyped new rows and the offset following the last complete line.
+
+    """
+    with open(path, "rb") as file:
+        file.seek(offset)
+        tail = file.read()
+    end = tail.rfind(b"\n") + 1
+    if end == 0:
+        return pd.DataFrame(columns=names), offset
+
+    try:
+        rows = pd.read_csv(io.BytesIO(tail[:end]), header=None, names=names, encoding="utf-8")
+    except UnicodeDecodeError:
+        rows = pd.read_csv(io.BytesIO(tail[:end]), header=None, names=names, encoding="latin1")
+    return rows, offset + end
+
+
+def read_storage_header(path):
+    """Returns the column names from the header line of the storage CSV."""
+    return pd.read_csv(path, nrows=0, encoding="latin1").columns.tolist()
+
+
+def parse_storage_csv(path):
+    """Reads and types the storage CSV without touching the on-disk cache."""
+    return convert_storage_types(read_storage_csv(path))
+
+
+def file_content_hash(path, block_size=1 << 20):
+    """Returns the blake2b hex digest of a file's content."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_signature(path):
+    """Returns the cheap (size, mtime) signature of a source file."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _read_cache_meta(meta_path):
+    try:
+        with open(meta_path, encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache_meta(meta_path, meta):
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(meta, file)
+    os.replace(tmp_path, meta_path)
+
+
+def _cache_is_fresh(path, cache_path, meta_path):
+    """Checks the cache against the source file by size, mtime and content hash.
+
+    Size and mtime are compared first. The content hash is only computed when they
+    differ, so a touched but unchanged file does not trigger a rebuild.
+    """
+    meta = _read_cache_meta(meta_path)
+    if meta is None or meta.get("version") != CACHE_VERSION or not os.path.exists(cache_path):
+        return False
+
+    size, mtime_ns = source_signature(path)
+    if meta.get("size") == size and meta.get("mtime_ns") == mtime_ns:
+        return True
+    if meta.get("size") != size:
+        return False
+
+    if meta.get("content_hash") != file_content_hash(path):
+        return False
+
+    meta["mtime_ns"] = mtime_ns
+    _write_cache_meta(meta_path, meta)
+    return True
+
+
+def build_storage_cache(path, cache_path=None):
+    """Parses the storage CSV and writes it to an uncompressed Arrow IPC file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the storage CSV.
+    cache_path : str (optional)
+        Target of the Arrow file. Defaults to the CSV path with an `.arrow` suffix.
+
+    Returns
+    -------
+    DataFrame
+        The typed storage data.
+
+    """
+    cache_path = cache_path or path + CACHE_SUFFIX
+    meta_path = cache_path + ".json"
+
+    size, mtime_ns = source_signature(path)
+    content_hash = file_content_hash(path)
+    df = parse_storage_csv(path)
+
+    tmp_path = cache_path + ".tmp"
+    feather.write_feather(df, tmp_path, compression="uncompressed")
+    os.replace(tmp_path, cache_path)
+    _write_cache_meta(
+        meta_path,
+        {"version": CACHE_VERSION, "size": size, "mtime_ns": mtime_ns, "content_hash": content_hash},
+    )
+    return df
+
+
+def read_storage_cache(cache_path):
+    """Reads the Arrow cache memory-mapped, so numeric columns are not copied on load."""
+    table = feather.read_table(cache_path, memory_map=True)
+    return table.to_pandas(split_blocks=True)
+
+
+def load_storage(path, use_cache=True):
+    """Loads the typed storage data, going through the on-disk Arrow cache.
+
+    The CSV is only parsed when the cache is missing or the source file has changed.
+    A cache that cannot be read or written falls back to parsing the CSV directly.
+
+    Parameters
+    ----------
+    path : str
+        Path to the storage CSV.
+    use_cache : bool = True
+        If false, always parses the CSV and leaves the cache untouched.
+
+    Returns
+    -------
+    DataFrame
+        Typed storage data.
+
+    """
+    if not use_cache:
+        return parse_storage_csv(path)
+
+    cache_path = path + CACHE_SUFFIX
+    meta_path = path + CACHE_META_SUFFIX
+    try:
+        if _cache_is_fresh(path, cache_path, meta_path):
+            return read_storage_cache(cache_path)
+        return build_storage_cache(path, cache_path)
+    except (OSError, pa.ArrowException):
+        if not os.path.exists(path):
+            raise
+        return parse_storage_csv(path)
+
+
+def build_daily_cube(df):
+    """Pre-aggregates the storage data into a (Date x Country) cube.
+
+    Every measure gets a `<measure>_sum` and a `<measure>_count` column, so totals and
+    means for any set of countries can be rebuilt from the cube without going back to
+    the facility rows.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Typed storage data.
+
+    Returns
+    -------
+    DataFrame
+        Cube indexed by a sorted (Date, Country) MultiIndex.
+
+    """
+    # Totals are accumulated in float64 even when the measures are stored as float32
+    measures = df[CUBE_MEASURES].astype("float64")
+    cube = measures.groupby([df["Date"], df["Country"]], sort=True, observed=True).agg(["sum", "count"])
+    cube.columns = [f"{measure}_{stat}" for measure, stat in cube.columns]
+    return cube
+
+
+def query_daily_cube(cube, countries=None, start_date=None, end_date=None):
+    """Sums cube slices into daily totals for a country selection and date range.
+
+    Parameters
+    ----------
+    cube : DataFrame
+        Cube built by `build_daily_cube`.
+    countries : list[str] = None
+        (optional) Countries to include. All countries are used if not populated.
+    start_date, end_date : datetime = None
+        (optional) Inclusive date bounds.
+
+    Returns
+    -------
+    DataFrame
+        One row per date with the summed `_sum` and `_count` columns.
+
+    """
+    if start_date is not None or end_date is not None:
+        cube = cube.loc[pd.IndexSlice[start_date:end_date, :], :]
+    if countries is not None:
+        cube = cube[cube.index.get_level_values("Country").isin(countries)]
+    return cube.groupby(level="Date").sum()
+
+
+def slice_date_range(df, start_date=None, end_date=None):
+    """Returns the rows between two dates (inclusive) as a positional slice.
+
+    Relies on the frame being sorted by Date, which `convert_storage_types` ensures, so
+    the bounds are found with a binary search and no boolean mask is built.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Storage data sorted by Date.
+    start_date, end_date : datetime = None
+        (optional) Inclusive date bounds.
+
+    Returns
+    -------
+    DataFrame
+        Slice of `df`.
+
+    """
+    dates = df["Date"]
+    start = 0 if start_date is None else dates.searchsorted(pd.Timestamp(start_date), side="left")
+    end = len(df) if end_date is None else dates.searchsorted(pd.Timestamp(end_date), side="right")
+    return df.iloc[start:end]
+
+
+def _category_lookup(column, values):
+    """Boolean lookup table over a categorical's codes, with a trailing False slot for NaN (-1)."""
+    codes = column.cat.categories.get_indexer(list(values))
+    lookup = np.zeros(len(column.cat.categories) + 1, dtype=bool)
+    lookup[codes[codes >= 0]] = True
+    return lookup
+
+
+def filter_by_category(df, column, values):
+    """Keeps the rows whose categorical `column` is one of `values`.
+
+    Values are resolved to category codes once, and rows are then matched by indexing a
+    lookup table with the integer codes instead of comparing strings.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Storage data.
+    column : str
+        Name of a categorical column, e.g. "Country" or "Name".
+    values : list[str]
+        Values to keep.
+
+    Returns
+    -------
+    DataFrame
+        Filtered rows.
+
+    """
+    lookup = _category_lookup(df[column], values)
+    return df[lookup[df[column].cat.codes.to_numpy()]]
+
+
+def present_categories(df, column):
+    """Returns the sorted categories of `column` that occur in `df`."""
+    categories = df[column].cat.categories
+    codes = df[column].cat.codes.to_numpy()
+    counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+    return sorted(categories[counts > 0].tolist())
+
+
+def latest_snapshot(df):
+    """Returns the latest row of every facility.
+
+    Uses an idxmax over Date per (Name, Country) group, which is a single linear pass
+    instead of sorting the whole frame and dropping duplicates.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Storage data.
+
+    Returns
+    -------
+    DataFrame
+        One row per facility.
+
+    """
+    if df.empty:
+        return df
+    latest_index = df.groupby(FACILITY_KEYS, observed=True, sort=False, dropna=False)["Date"].idxmax()
+    return df.loc[latest_index.to_numpy()]
+
+
+def align_categoricals(df, new_rows):
+    """Gives the categorical columns of both frames the union of their categories.
+
+    `pd.concat` only keeps a categorical column if its categories are identical on both
+    sides, and falls back to object otherwise.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Typed storage data. It is not modified.
+    new_rows : DataFrame
+        Typed rows with the columns of `df`. It is not modified.
+
+    Returns
+    -------
+    tuple[DataFrame, DataFrame]
+        Copies of `df` and of the `df` columns of `new_rows`, with aligned categoricals.
+
+    """
+    df, new_rows = df.copy(deep=False), new_rows[df.columns].copy()
+    for col in df.columns:
+        if not isinstance(df[col].dtype, pd.CategoricalDtype):
+            continue
+        added = new_rows[col].astype("category").cat.categories.difference(df[col].cat.categories)
+        if len(added):
+            df[col] = df[col].cat.add_categories(added)
+        new_rows[col] = pd.Categorical(new_rows[col], categories=df[col].cat.categories)
+    return df, new_rows
+
+
+def _align_country_level(cube, new_cube):
+    """Gives the Country level of both cubes the union of their categories."""
+    old_level = cube.index.levels[cube.index.names.index("Country")]
+    new_level = new_cube.index.levels[new_cube.index.names.index("Country")]
+    if not isinstance(old_level.dtype, pd.CategoricalDtype):
+        return cube, new_cube
+    new_categories = new_level.categories if isinstance(new_level.dtype, pd.CategoricalDtype) else new_level
+    categories = old_level.categories.append(new_categories.difference(old_level.categories))
+
+    def with_categories(frame, level):
+        # Same values in the same order, only the categories of the dtype change
+        level = pd.CategoricalIndex(level, categories=categories, name="Country")
+        return frame.set_axis(frame.index.set_levels(level, level="Country", verify_integrity=False), axis=0)
+
+    return with_categories(cube, old_level), with_categories(new_cube, new_level)
+
+
+def append_storage_rows(df, new_rows):
+    """Appends typed rows to the storage data, keeping the categoricals and the Date order.
+
+    Categories seen for the first time are added to the existing categoricals, so the
+    result keeps categorical columns instead of falling back to object. The result is
+    only re-sorted if the new rows start before the last date of `df`.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Typed storage data sorted by Date. It is not modified.
+    new_rows : DataFrame
+        Typed rows with the same columns, as returned by `convert_storage_types`.
+
+    Returns
+    -------
+    DataFrame
+        A new frame holding the rows of both.
+
+    """
+    if new_rows.empty:
+        return df
+    if df.empty:
+        return new_rows
+
+    df, new_rows = align_categoricals(df, new_rows)
+    in_order = new_rows["Date"].iloc[0] >= df["Date"].iloc[-1] and new_rows["Date"].is_monotonic_increasing
+    combined = pd.concat([df, new_rows], ignore_index=True)
+    if not in_order:
+        combined = combined.sort_values("Date", kind="stable", ignore_index=True)
+    return combined
+
+
+def update_daily_cube(cube, new_rows):
+    """Adds newly appended rows to a cube built by `build_daily_cube`.
+
+    Only the new rows are aggregated. Their cells are appended to the cube, or summed
+    into the existing cells when they fall on (Date, Country) pairs already present.
+    """
+    if new_rows.empty:
+        return cube
+    cube, new_cube = _align_country_level(cube, build_daily_cube(new_rows))
+    combined = pd.concat([cube, new_cube])
+    if combined.index.is_unique and combined.index.is_monotonic_increasing:
+        return combined
+    return combined.groupby(level=["Date", "Country"], sort=True, observed=True).sum()
+
+
+def update_latest_snapshot(snapshot, new_rows):
+    """Folds newly appended rows into an existing snapshot.
+
+    Only the snapshot and the new rows are scanned, so the cost does not depend on the
+    length of the history.
+    """
+    if new_rows.empty:
+        return snapshot
+    if snapshot.empty:
+        return latest_snapshot(new_rows)
+    return latest_snapshot(pd.concat(align_categoricals(snapshot, new_rows), ignore_index=True))
+
+
+def country_snapshot(snapshot):
+    """Rolls a per-facility snapshot up to one row per country.
+
+    Volumes and flows are summed over the facilities of each country, and the fill
+    percentage is recomputed from the summed volumes so larger sites weigh more.
+
+    Parameters
+    ----------
+    snapshot : DataFrame
+        Per-facility snapshot as returned by `latest_snapshot`.
+
+    Returns
+    -------
+    DataFrame
+        One row per country with gasInStorage, workingGasVolume, injection, withdrawal,
+        full and the number of facilities.
+
+    """
+    volumes = ["gasInStorage", "workingGasVolume", "injection", "withdrawal"]
+    snapshot = snapshot[["Country", "Name"]].join(snapshot[volumes].astype("float64"))
+    summary = snapshot.groupby("Country", observed=True).agg(
+        gasInStorage=("gasInStorage", "sum"),
+        workingGasVolume=("workingGasVolume", "sum"),
+        injection=("injection", "sum"),
+        withdrawal=("withdrawal", "sum"),
+        facilities=("Name", "size"),
+    )
+    summary["full"] = summary["gasInStorage"] / summary["workingGasVolume"].replace(0, np.nan) * 100
+    return summary.reset_index()
+
+
+class StorageStore:
+    """Process-wide, read-only copy of the storage data and the aggregates built from it.
+
+    Meant to be shared by every dashboard session (e.g. through `st.cache_resource`), so
+    the frame is held once per process instead of once per session. Readers must treat
+    `df`, `cube` and `latest` as immutable. A refresh swaps in new objects instead of
+    mutating the current ones, so a session that is still rendering keeps a consistent view.
+
+    `refresh` ingests new data incrementally. Rows appended to the CSV are found by byte
+    offset and only the tail is parsed. If the file was rewritten instead, the rows newer
+    than the LastUpdateTime watermark are taken from it. Either way the cube and the
+    latest snapshot are updated from the new rows only.
+
+    Parameters
+    ----------
+    path : str
+        Path to the storage CSV.
+    use_cache : bool = True
+        If true, full loads go through the on-disk Arrow cache.
+
+    """
+
+    # Bytes before the read offset that must be unchanged for the file to count as appended to
+    GUARD_BYTES = 4096
+
+    def __init__(self, path, use_cache=True):
+        self.path = path
+        self.use_cache = use_cache
+        self.df = None
+        self.cube = None
+        self.latest = None
+        self.signature = None
+        self.offset = 0
+        self.watermark = None
+        self.version = 0
+        self._names = None
+        self._guard = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _read_guard(self, offset):
+        start = max(offset - self.GUARD_BYTES, 0)
+        with open(self.path, "rb") as file:
+            file.seek(start)
+            return file.read(offset - start)
+
+    def _set_data(self, df, cube, latest, signature, offset):
+        """Swaps in new data and bumps the data version. Must be called with the lock held."""
+        self.df, self.cube, self.latest = df, cube, latest
+        self.signature = signature
+        self.offset = offset
+        self._guard = self._read_guard(offset)
+        if "LastUpdateTime" in df.columns and not df.empty:
+            self.watermark = df["LastUpdateTime"].max()
+        self.version += 1
+
+    def reload(self):
+        """Loads the data again from disk and rebuilds every aggregate."""
+        with self._lock:
+            self._reload()
+
+    def _reload(self, df=None):
+        signature = source_signature(self.path)
+        self._names = read_storage_header(self.path)
+        if df is None:
+            df = load_storage(self.path, use_cache=self.use_cache)
+        self._set_data(df, build_daily_cube(df), latest_snapshot(df), signature, signature[0])
+
+    def _ingest(self, new_rows, signature, offset):
+        """Merges typed new rows into the data and the aggregates."""
+        if new_rows.empty:
+            self.signature, self.offset = signature, offset
+            self._guard = self._read_guard(offset)
+            return
+        self._set_data(
+            append_storage_rows(self.df, new_rows),
+            update_daily_cube(self.cube, new_rows),
+            update_latest_snapshot(self.latest, new_rows),
+            signature,
+            offset,
+        )
+
+    def _is_appended(self, size):
+        return size >= self.offset and self._read_guard(self.offset) == self._guard
+
+    def refresh(self):
+        """Brings the data up to date with the source file.
+
+        Returns
+        -------
+        int
+            Number of rows ingested. A full reload counts every row, 0 means the data
+            was already current.
+
+        """
+        with self._lock:
+            signature = source_signature(self.path)
+            if signature == self.signature:
+                return 0
+
+            if self._is_appended(signature[0]):
+                start = self.offset
+                raw, offset = read_storage_csv_tail(self.path, start, self._names)
+                new_rows = convert_storage_types(raw) if not raw.empty else raw
+                self._ingest(new_rows, signature, offset)
+                logger.info("Storage data: %d rows appended from byte %d", len(new_rows), start)
+                return len(new_rows)
+
+            # Rewritten file: the history is kept if it still matches, else everything is replaced
+            df = parse_storage_csv(self.path)
+            if self.watermark is not None and "LastUpdateTime" in df.columns:
+                is_new = (df["LastUpdateTime"] > self.watermark).to_numpy()
+                if len(df) - is_new.sum() == len(self.df):
+                    new_rows = df[is_new]
+                    self._names = read_storage_header(self.path)
+                    self._ingest(new_rows, signature, signature[0])
+                    logger.info("Storage data: %d rows newer than %s ingested", len(new_rows), self.watermark)
+                    return len(new_rows)
+            self._reload(df)
+            return len(df)
+
+    def snapshot(self):
+        """Returns a consistent (df, cube, latest, version) tuple."""
+        with self._lock:
+            return self.df, self.cube, self.latest, self.version
+
+    def is_stale(self):
+        """Returns True if the source file changed since the data was last refreshed."""
+        return source_signature(self.path) != self.signature
+
+    def reload_if_changed(self):
+        """Refreshes the data if the source file changed. Returns True if it did."""
+        if not self.is_stale():
+            return False
+        self.refresh()
+        return True
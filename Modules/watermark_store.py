@@ -0,0 +1,111 @@
+"""Keeps the last loaded date of every SQL table in a small local SQLite file.
+
+The watermark of a table lets incremental jobs know how far the table is loaded
+without asking the server for `TOP (1) ... ORDER BY [Date] DESC` on every run.
+"""
+
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# Where the watermarks are kept
+WATERMARK_DB = os.getenv("SQL_WATERMARK_DB", ".sql_watermarks.db")
+
+# Stored watermarks older than this are checked against the server again, so rows
+# written by other processes are picked up
+WATERMARK_MAX_AGE = timedelta(hours=float(os.getenv("SQL_WATERMARK_MAX_AGE_HOURS", "24")))
+
+
+class WatermarkStore:
+    """Last loaded date per table, stored in SQLite.
+
+    Parameters
+    ----------
+    path : str (optional)
+        SQLite file of the store. Defaults to `WATERMARK_DB`.
+
+    """
+
+    def __init__(self, path=None):
+        self.path = path or WATERMARK_DB
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    server TEXT NOT NULL,
+                    database TEXT NOT NULL,
+                    schema TEXT NOT NULL,
+                    table_name TEXT NOT NULL,
+                    watermark TEXT NOT NULL,
+                    updated TEXT NOT NULL,
+                    PRIMARY KEY (server, database, schema, table_name)
+                )
+                """,
+            )
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call, so the store can be used from any thread
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key, max_age=None):
+        """Returns the watermark of a table.
+
+        Parameters
+        ----------
+        key : tuple[str, str, str, str]
+            Server, database, schema and table name.
+        max_age : timedelta (optional)
+            If populated, watermarks stored longer ago than this are ignored.
+
+        Returns
+        -------
+        datetime or None
+            The watermark, or None if there is no (recent enough) watermark.
+
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT watermark, updated FROM watermarks WHERE server = ? AND database = ? AND schema = ? AND table_name = ?",
+                key,
+            ).fetchone()
+        if row is None:
+            return None
+        if max_age is not None and datetime.now() - datetime.fromisoformat(row[1]) > max_age:
+            return None
+        return datetime.fromisoformat(row[0])
+
+    def set(self, key, watermark):
+        """Stores the watermark of a table, replacing the previous one."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, watermark.isoformat(), datetime.now().isoformat()),
+            )
+
+    def advance(self, key, watermark):
+        """Moves a stored watermark forward to `watermark`, if that is later.
+
+        Tables without a stored watermark are left alone: rows written by this process
+        alone do not tell how far the table is loaded.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE watermarks SET watermark = ? "
+                "WHERE server = ? AND database = ? AND schema = ? AND table_name = ? AND watermark < ?",
+                (watermark.isoformat(), *key, watermark.isoformat()),
+            )
+
+    def clear(self, key):
+        """Removes the watermark of a table."""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM watermarks WHERE server = ? AND database = ? AND schema = ? AND table_name = ?",
+                key,
+            )
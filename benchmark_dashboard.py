@@ -0,0 +1,210 @@
+"""Benchmarks the data paths of the storage dashboard on synthetic scaled-up histories.
+
+Usage:
+    python benchmark_dashboard.py --scales 10 100 1000 --output benchmark_results.json
+
+Each scale multiplies the number of rows of Storage.csv: facilities are cloned up to
+10x, and the daily history is extended back in time for the rest of the factor. Every
+stage of the dashboard is timed and its traced, Arrow and resident memory recorded, and the results are
+written as JSON so runs can be compared with each other.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import pyarrow as pa
+
+from Modules import chart_tools, storage_data
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SOURCE_CSV = "Storage.csv"
+MAX_FACILITY_FACTOR = 10
+
+
+def split_scale(scale):
+    """Splits a row multiplier into a facility factor and a history factor."""
+    facility_factor = min(scale, MAX_FACILITY_FACTOR)
+    history_factor = max(int(round(scale / facility_factor)), 1)
+    return facility_factor, history_factor
+
+
+def generate_storage_history(source, facility_factor, history_factor, seed=0):
+    """Builds a synthetic storage history with the schema of Storage.csv.
+
+    Parameters
+    ----------
+    source : DataFrame
+        Raw Storage.csv rows, as read by `storage_data.read_storage_csv`.
+    facility_factor : int
+        Number of copies of every facility. Copies get a ` #n` suffix to their name.
+    history_factor : int
+        Number of copies of the daily history, each shifted back by the source span.
+    seed : int = 0
+        Seed for the noise added to the volumes, so runs are reproducible.
+
+    Returns
+    -------
+    DataFrame
+        Raw rows in the Storage.csv layout, with the same string date formats.
+
+    """
+    rng = np.random.default_rng(seed)
+    base = source.copy()
+    dates = pd.to_datetime(base["Date"])
+    span = dates.max() - dates.min() + pd.Timedelta(days=1)
+
+    parts = []
+    for facility_copy in range(facility_factor):
+        for history_copy in range(history_factor):
+            part = base.copy()
+            if facility_copy:
+                part["Name"] = part["Name"] + f" #{facility_copy}"
+            shifted = dates - span * history_copy
+            part["Year"] = shifted.dt.year
+            part["Month"] = shifted.dt.month
+            part["Day"] = shifted.dt.day
+            part["Date"] = part["Month"].astype(str) + "/" + part["Day"].astype(str) + "/" + part["Year"].astype(str)
+            part["Week"] = shifted.dt.isocalendar().week.astype("int64")
+            noise = rng.uniform(0.9, 1.1, len(part))
+            for col in ["gasInStorage", "injection", "withdrawal"]:
+                part[col] = (part[col] * noise).round(4)
+            parts.append((shifted.to_numpy(), part))
+
+    order = np.argsort(np.concatenate([part_dates for part_dates, _ in parts]), kind="stable")
+    history = pd.concat([part for _, part in parts], ignore_index=True)
+    # Keep the file in date order, like the real export
+    return history.iloc[order]
+
+
+def max_rss_mb():
+    """Peak resident memory of the process so far, or None where `resource` is not available."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return round(max_rss / 1024**2 if sys.platform == "darwin" else max_rss / 1024, 3)
+
+
+def run_stage(results, name, func):
+    """Runs `func`, storing its wall time and memory under `name`.
+
+    tracemalloc only sees Python allocations, not the Arrow memory pool, so the
+    Arrow memory the stage still holds and the peak RSS of the process so far are stored too.
+    """
+    arrow_before = pa.total_allocated_bytes()
+    tracemalloc.start()
+    start = time.perf_counter()
+    value = func()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results[name] = {
+        "seconds": round(seconds, 6),
+        "peak_mb": round(peak / 1024**2, 3),
+        "arrow_mb": round((pa.total_allocated_bytes() - arrow_before) / 1024**2, 3),
+        "max_rss_mb": max_rss_mb(),
+    }
+    return value
+
+
+def benchmark_scale(source, scale, work_dir):
+    """Times every dashboard stage on a history `scale` times larger than the source."""
+    facility_factor, history_factor = split_scale(scale)
+    history = generate_storage_history(source, facility_factor, history_factor)
+    path = os.path.join(work_dir, f"Storage_{scale}x.csv")
+    history.to_csv(path, index=False, encoding="utf-8")
+    del history
+
+    stages = {}
+    raw = run_stage(stages, "parse", lambda: storage_data.read_storage_csv(path))
+    df = run_stage(stages, "type_conversion", lambda: storage_data.convert_storage_types(raw))
+    del raw
+    run_stage(stages, "cache_build", lambda: storage_data.build_storage_cache(path))
+    df = run_stage(stages, "cache_load", lambda: storage_data.load_storage(path))
+
+    # Dashboard interaction: last 30% of the history, three countries
+    dates = df["Date"]
+    start_date = dates.iloc[int(len(df) * 0.7)]
+    end_date = dates.iloc[-1]
+    countries = storage_data.present_categories(df, "Country")[:3]
+
+    filtered = run_stage(stages, "date_filter", lambda: storage_data.slice_date_range(df, start_date, end_date))
+    filtered = run_stage(stages, "country_filter", lambda: storage_data.filter_by_category(filtered, "Country", countries))
+    latest = run_stage(stages, "latest_snapshot", lambda: storage_data.latest_snapshot(filtered))
+    run_stage(stages, "country_rollup", lambda: storage_data.country_snapshot(latest))
+    cube = run_stage(stages, "daily_cube_build", lambda: storage_data.build_daily_cube(df))
+    daily = run_stage(
+        stages,
+        "groupby_trends",
+        lambda: storage_data.query_daily_cube(cube, countries, start_date, end_date),
+    )
+
+    def build_figure():
+        trend = pd.DataFrame({"AvgFillPercentage": daily["full_sum"] / daily["full_count"]}).reset_index()
+        figure = px.line(chart_tools.prepare_series(trend, "Date", "AvgFillPercentage"), x="Date", y="AvgFillPercentage")
+        return len(figure.to_json())
+
+    payload_bytes = run_stage(stages, "figure_build", build_figure)
+
+    return {
+        "scale": scale,
+        "facility_factor": facility_factor,
+        "history_factor": history_factor,
+        "rows": len(df),
+        "facilities": int(df["Name"].nunique()),
+        "days": int(df["Date"].nunique()),
+        "csv_mb": round(os.path.getsize(path) / 1024**2, 3),
+        "frame_mb": round(storage_data.frame_memory_mb(df), 3),
+        "figure_payload_bytes": payload_bytes,
+        "stages": stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--source", default=SOURCE_CSV)
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    source = storage_data.read_storage_csv(args.source)
+    # Plotly loads its figure machinery lazily, keep that out of the first figure_build timing
+    px.line(pd.DataFrame({"x": [0, 1], "y": [0, 1]}), x="x", y="y").to_json()
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for scale in args.scales:
+            print(f"Benchmarking {scale}x ...")
+            result = benchmark_scale(source, scale, work_dir)
+            results.append(result)
+            slowest = max(result["stages"].items(), key=lambda item: item[1]["seconds"])
+            print(f"{scale}x: {result['rows']} rows, slowest stage {slowest[0]} ({slowest[1]['seconds']:.3f}s)")
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,33 @@
+import os
+
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 
+from Modules import chart_tools, storage_data
+
 # Set page configuration for a wider layout
 st.set_page_config(layout="wide", page_title="European Gas Storage Monitoring")
 
+# Opt-in: serve every session from one shared, read-only copy of the data instead of
+# the per-session copies returned by st.cache_data. Enable with SHARED_STORAGE_STORE=True.
+SHARED_STORAGE_STORE = os.getenv("SHARED_STORAGE_STORE") == "True"
+
+if SHARED_STORAGE_STORE:
+    # Sessions share the same frame, so derived frames must never write back into it
+    pd.set_option("mode.copy_on_write", True)
+
 # --- Data Loading and Preprocessing ---
 @st.cache_data
 def load_data():
     """
-    Loads the gas storage data from a CSV file and performs initial preprocessing.
-    Caches the data to improve performance.
+    Loads the gas storage data and performs initial preprocessing.
+    The typed data is kept in an on-disk Arrow cache next to Storage.csv, so the CSV
+    is only parsed again when it changes. Caches the data to improve performance.
     """
     try:
-        # Attempt to read with utf-8, then fall back to latin1 if UnicodeDecodeError occurs
-        try:
-            df = pd.read_csv('Storage.csv', encoding='utf-8')
-        except UnicodeDecodeError:
-            df = pd.read_csv('Storage.csv', encoding='latin1')
-
-        # Convert 'Date' column to datetime objects
-        df['Date'] = pd.to_datetime(df['Date'])
-        # Ensure numerical columns are of the correct type, handling potential errors
-        numerical_cols = ['gasInStorage', 'full', 'injection', 'withdrawal',
-                          'workingGasVolume', 'injectionCapacity', 'withdrawalCapacity']
-        for col in numerical_cols:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-        return df
+        return storage_data.load_storage('Storage.csv')
     except FileNotFoundError:
         st.error("Error: Storage.csv not found. Please ensure the file is in the root directory.")
         st.stop()
@@ -35,7 +35,58 @@ def load_data():
         st.error(f"Error loading or processing data: {e}")
         st.stop()
 
-df = load_data()
+
+@st.cache_data
+def load_daily_cube():
+    """
+    Builds the (Date x Country) aggregate cube used by the trend charts.
+    Cached alongside the data so reruns only sum cube slices.
+    """
+    return storage_data.build_daily_cube(load_data())
+
+
+@st.cache_data
+def load_latest_snapshot():
+    """
+    Finds the latest row of every facility over the whole history. Views whose date
+    range reaches the last date reuse it instead of scanning the filtered rows.
+    """
+    return storage_data.latest_snapshot(load_data())
+
+
+@st.cache_resource
+def load_storage_store():
+    """
+    Loads the shared storage store once per process. Every session reads the same
+    frame and cube without copying them.
+    """
+    return storage_data.StorageStore('Storage.csv')
+
+
+def load_shared_data():
+    """
+    Returns the data, cube, latest snapshot and data version from the shared store.
+    Rows added to Storage.csv since the last run are ingested first, which only parses
+    and aggregates the new rows.
+    """
+    try:
+        store = load_storage_store()
+        store.refresh()
+        return store.snapshot()
+    except FileNotFoundError:
+        st.error("Error: Storage.csv not found. Please ensure the file is in the root directory.")
+        st.stop()
+    except Exception as e:
+        st.error(f"Error loading or processing data: {e}")
+        st.stop()
+
+
+# The default data only changes when Streamlit's caches are cleared, which also clears the
+# figure cache, so it keeps a constant version. The shared store bumps its version on refresh.
+if SHARED_STORAGE_STORE:
+    df, daily_cube, latest_all, data_version = load_shared_data()
+else:
+    df, daily_cube, latest_all, data_version = load_data(), load_daily_cube(), load_latest_snapshot(), 0
 
 # Check if data loaded successfully
 if df is None:
@@ -76,8 +127,9 @@ st.markdown("""
 st.sidebar.header("Filters")
 
 # Date Range Slider
-min_date = df['Date'].min().to_pydatetime()
-max_date = df['Date'].max().to_pydatetime()
+# The data is sorted by Date, so the bounds are the first and last rows
+min_date = df['Date'].iloc[0].to_pydatetime()
+max_date = df['Date'].iloc[-1].to_pydatetime()
 date_range = st.sidebar.date_input(
     "Select Date Range",
     value=(min_date, max_date),
@@ -85,16 +137,18 @@ date_range = st.sidebar.date_input(
     max_value=max_date
 )
 
+trend_start_date, trend_end_date = None, None
 if len(date_range) == 2:
     start_date, end_date = date_range
-    filtered_df = df[(df['Date'] >= pd.to_datetime(start_date)) & (df['Date'] <= pd.to_datetime(end_date))]
+    trend_start_date, trend_end_date = pd.to_datetime(start_date), pd.to_datetime(end_date)
+    filtered_df = storage_data.slice_date_range(df, trend_start_date, trend_end_date)
 else:
-    filtered_df = df.copy()
+    filtered_df = df
     st.sidebar.warning("Please select a complete date range.")
 
 
 # Country Multiselect with 'All' option
-all_countries = sorted(filtered_df['Country'].unique().tolist())
+all_countries = storage_data.present_categories(filtered_df, 'Country')
 country_options = ["All"] + all_countries
 
 selected_countries = st.sidebar.multiselect(
@@ -105,12 +159,14 @@ selected_countries = st.sidebar.multiselect(
 
 # If 'All' is selected or nothing is selected, use all countries
 if "All" in selected_countries or not selected_countries:
-    filtered_df = filtered_df[filtered_df['Country'].isin(all_countries)]
+    filtered_df = storage_data.filter_by_category(filtered_df, 'Country', all_countries)
+    trend_countries = None
 else:
-    filtered_df = filtered_df[filtered_df['Country'].isin(selected_countries)]
+    filtered_df = storage_data.filter_by_category(filtered_df, 'Country', selected_countries)
+    trend_countries = selected_countries
 
 # Facility Multiselect
-all_facilities = sorted(filtered_df['Name'].unique().tolist())
+all_facilities = storage_data.present_categories(filtered_df, 'Name')
 selected_facilities = st.sidebar.multiselect(
     "Select Facilities",
     options=all_facilities,
@@ -118,22 +174,75 @@ selected_facilities = st.sidebar.multiselect(
 )
 
 if selected_facilities:
-    filtered_df_facility = filtered_df[filtered_df['Name'].isin(selected_facilities)]
+    filtered_df_facility = storage_data.filter_by_category(filtered_df, 'Name', selected_facilities)
 else:
-    filtered_df_facility = filtered_df.copy() # If no specific facility selected, use all filtered data
+    filtered_df_facility = filtered_df # If no specific facility selected, use all filtered data
+
+# Long time series are downsampled to the chart width unless full resolution is requested
+full_resolution_charts = st.sidebar.checkbox(
+    "Full resolution charts",
+    value=False,
+    help="Plot every daily point instead of a downsampled series sized to the chart."
+)
+
+
+def chart_series(data, y, method="lttb"):
+    """
+    Returns the Date and `y` columns of `data`, reduced to what a chart can display.
+    """
+    return chart_tools.prepare_series(data, 'Date', y, full_resolution=full_resolution_charts, method=method)
+
+country_key = tuple(sorted(trend_countries)) if trend_countries else None
+
+
+def selection_latest():
+    """
+    Returns the latest row per facility within the current filters. If the date range
+    reaches the last date, the whole-history snapshot only needs the facilities whose
+    latest row falls before the start date dropped, so the filtered rows are not scanned.
+    """
+    if trend_end_date is None or trend_end_date < max_date:
+        return storage_data.latest_snapshot(filtered_df)
+    latest = latest_all[latest_all['Date'] >= trend_start_date]
+    return storage_data.filter_by_category(latest, 'Country', trend_countries or all_countries)
+
+
+@st.cache_resource
+def load_figure_cache():
+    """
+    Creates the figure cache once per process. Its keys hold the full filter state and
+    the data version, so it can be shared by every session.
+    """
+    return chart_tools.FigureCache()
+
+
+figure_cache = load_figure_cache()
+
+
+def cached_figure(chart_id, build, *key_parts):
+    """
+    Returns the figure `chart_id` for the current filters from the figure cache, calling
+    `build` only on a miss. `key_parts` holds any extra input the figure depends on.
+    """
+    key = (chart_id, trend_start_date, trend_end_date, country_key, data_version, full_resolution_charts) + key_parts
+    return figure_cache.get_or_build(key, build)
 
 
 # --- Main Content Area ---
 
-tab1, tab2, tab3, tab4 = st.tabs(["Overview & Key Metrics", "Trend Analysis", "Country Comparison", "Facility Details"])
+# Only the selected view is computed on a rerun, unlike st.tabs which runs every tab
+TABS = ["Overview & Key Metrics", "Trend Analysis", "Country Comparison", "Facility Details"]
+active_tab = st.radio("View", TABS, horizontal=True, label_visibility="collapsed")
 
-with tab1:
+if active_tab == TABS[0]:
     st.header("Overview & Key Metrics")
 
     if not filtered_df.empty:
-        # Calculate key metrics for the selected period
-        latest_data = filtered_df.sort_values(by='Date', ascending=False).drop_duplicates(subset=['Name', 'Country'])
+        # Latest row per facility in the selection, used by the metric cards and the country views
+        latest_data = selection_latest()
+        latest_data_by_country = storage_data.country_snapshot(latest_data)
 
+        # Calculate key metrics for the selected period
         total_gas_in_storage = latest_data['gasInStorage'].sum()  if not latest_data.empty else 0 # Convert to BCM
         avg_fill_percentage = latest_data['full'].mean() if not latest_data.empty else 0
         total_working_volume = latest_data['workingGasVolume'].sum()  if not latest_data.empty else 0 # Convert to BCM
@@ -154,12 +263,12 @@ with tab1:
             st.metric(label="Total Withdrawal (GWh/d)", value=f"{sum_withdrawal_capacity:,.2f}")
 
         st.subheader(f"Current Gas Storage Status by Country on {max_date.strftime('%Y-%m-%d')}")
-        # Aggregate latest data by country
-        country_summary = latest_data.groupby('Country').agg(
-            GasInStorage=('gasInStorage', 'sum'),
-            FillPercentage=('full', 'mean'),
-            WorkingGasVolume=('workingGasVolume', 'sum')
-        ).reset_index()
+        # Latest data aggregated by country
+        country_summary = latest_data_by_country.rename(columns={
+            'gasInStorage': 'GasInStorage',
+            'full': 'FillPercentage',
+            'workingGasVolume': 'WorkingGasVolume'
+        })
 
         # Convert to BCM for display
         country_summary['GasInStorage (BCM)'] = country_summary['GasInStorage']
@@ -177,138 +286,168 @@ with tab1:
         country_summary_with_coords = country_summary.dropna(subset=['latitude', 'longitude'])
 
         if not country_summary_with_coords.empty:
-            fig_map = px.scatter_geo(
-                country_summary_with_coords,
-                lat="latitude",
-                lon="longitude",
-                locations="Country",
-                locationmode="country names",
-                color="FillPercentage (%)",
-                hover_name="Country",
-                size="GasInStorage (BCM)",
-                color_continuous_scale=px.colors.sequential.Viridis,
-            )
+            def build_map():
+                fig_map = px.scatter_geo(
+                    country_summary_with_coords,
+                    lat="latitude",
+                    lon="longitude",
+                    locations="Country",
+                    locationmode="country names",
+                    color="FillPercentage (%)",
+                    hover_name="Country",
+                    size="GasInStorage (BCM)",
+                    color_continuous_scale=px.colors.sequential.Viridis,
+                )
 
-            fig_map.update_layout(
-                title="Gas Storage Fill Percentage by Country",
-                geo=dict(
-                    scope='europe',
-                    projection_type='natural earth',
-                    showland=True,
-                    landcolor='rgb(217, 217, 217)',
+                fig_map.update_layout(
+                    title="Gas Storage Fill Percentage by Country",
+                    geo=dict(
+                        scope='europe',
+                        projection_type='natural earth',
+                        showland=True,
+                        landcolor='rgb(217, 217, 217)',
+                    )
                 )
-            )
+                return fig_map
 
-            st.plotly_chart(fig_map, use_container_width=True)
+            st.plotly_chart(cached_figure('storage_map', build_map), use_container_width=True)
         else:
             st.info(
                 "Map visualization is not available as geographical coordinates are missing for the selected countries.")
     else:
         st.warning("No data available for the selected filters.")
 
-with tab2:
+elif active_tab == TABS[1]:
     st.header("Trend Analysis")
 
     if not filtered_df.empty:
-        # Group by date and calculate average fill percentage and total gas in storage
-        trend_data = filtered_df.groupby('Date').agg(
-            AvgFillPercentage=('full', 'mean'),
-            TotalGasInStorage=('gasInStorage', 'sum')
-        ).reset_index()
+        # Daily totals for the selected countries, summed from the pre-aggregated cube
+        daily_totals = storage_data.query_daily_cube(daily_cube, trend_countries, trend_start_date, trend_end_date)
+
+        trend_data = pd.DataFrame({
+            'AvgFillPercentage': daily_totals['full_sum'] / daily_totals['full_count'],
+            'TotalGasInStorage': daily_totals['gasInStorage_sum']
+        }).reset_index()
 
         # Convert to BCM for plotting
         trend_data['TotalGasInStorage (BCM)'] = trend_data['TotalGasInStorage'] / 1_000_000_000
 
         st.subheader("Average Fill Percentage Over Time")
-        fig_fill_trend = px.line(
-            trend_data,
-            x='Date',
-            y='AvgFillPercentage',
-            title='Average Gas Storage Fill Percentage Trend',
-            labels={'AvgFillPercentage': 'Average Fill Percentage (%)'}
-        )
-        fig_fill_trend.update_traces(mode='lines+markers')
-        st.plotly_chart(fig_fill_trend, use_container_width=True)
+
+        def build_fill_trend():
+            fig_fill_trend = px.line(
+                chart_series(trend_data, 'AvgFillPercentage'),
+                x='Date',
+                y='AvgFillPercentage',
+                title='Average Gas Storage Fill Percentage Trend',
+                labels={'AvgFillPercentage': 'Average Fill Percentage (%)'}
+            )
+            fig_fill_trend.update_traces(mode='lines+markers')
+            return fig_fill_trend
+
+        st.plotly_chart(cached_figure('fill_trend', build_fill_trend), use_container_width=True)
 
         st.subheader("Total Gas in Storage Over Time")
-        fig_gas_trend = px.line(
-            trend_data,
-            x='Date',
-            y='TotalGasInStorage (BCM)',
-            title='Total Gas in Storage Trend',
-            labels={'TotalGasInStorage (BCM)': 'Total Gas in Storage (BCM)'}
-        )
-        fig_gas_trend.update_traces(mode='lines+markers')
-        st.plotly_chart(fig_gas_trend, use_container_width=True)
+
+        def build_gas_trend():
+            fig_gas_trend = px.line(
+                chart_series(trend_data, 'TotalGasInStorage (BCM)'),
+                x='Date',
+                y='TotalGasInStorage (BCM)',
+                title='Total Gas in Storage Trend',
+                labels={'TotalGasInStorage (BCM)': 'Total Gas in Storage (BCM)'}
+            )
+            fig_gas_trend.update_traces(mode='lines+markers')
+            return fig_gas_trend
+
+        st.plotly_chart(cached_figure('gas_trend', build_gas_trend), use_container_width=True)
 
         st.subheader("Daily Injection/Withdrawal Volumes Over Time")
         # Sum injection and withdrawal for the selected period
-        daily_flow = filtered_df.groupby('Date').agg(
-            TotalInjection=('injection', 'sum'),
-            TotalWithdrawal=('withdrawal', 'sum')
-        ).reset_index()
-
-        fig_flow = go.Figure()
-        fig_flow.add_trace(go.Scatter(x=daily_flow['Date'], y=daily_flow['TotalInjection'], mode='lines', name='Total Injection'))
-        fig_flow.add_trace(go.Scatter(x=daily_flow['Date'], y=daily_flow['TotalWithdrawal'], mode='lines', name='Total Withdrawal'))
-        fig_flow.update_layout(
-            title='Daily Total Injection/Withdrawal Volumes',
-            xaxis_title='Date',
-            yaxis_title='Volume (MCM/day)',
-            hovermode="x unified"
-        )
-        st.plotly_chart(fig_flow, use_container_width=True)
+        daily_flow = pd.DataFrame({
+            'TotalInjection': daily_totals['injection_sum'],
+            'TotalWithdrawal': daily_totals['withdrawal_sum']
+        }).reset_index()
+
+        def build_flow():
+            # Flows are noisy, keep the daily extremes when downsampling
+            injection_series = chart_series(daily_flow, 'TotalInjection', method='minmax')
+            withdrawal_series = chart_series(daily_flow, 'TotalWithdrawal', method='minmax')
+
+            fig_flow = go.Figure()
+            fig_flow.add_trace(go.Scatter(x=injection_series['Date'], y=injection_series['TotalInjection'], mode='lines', name='Total Injection'))
+            fig_flow.add_trace(go.Scatter(x=withdrawal_series['Date'], y=withdrawal_series['TotalWithdrawal'], mode='lines', name='Total Withdrawal'))
+            fig_flow.update_layout(
+                title='Daily Total Injection/Withdrawal Volumes',
+                xaxis_title='Date',
+                yaxis_title='Volume (MCM/day)',
+                hovermode="x unified"
+            )
+            return fig_flow
+
+        st.plotly_chart(cached_figure('flow_trend', build_flow), use_container_width=True)
 
     else:
         st.warning("No data available for trend analysis with the selected filters.")
 
-with tab3:
+elif active_tab == TABS[2]:
     st.header("Country-Level Comparison")
 
     if not filtered_df.empty:
-        # Group by country and get the latest available data for each country
-        latest_data_by_country = filtered_df.sort_values(by='Date', ascending=False).drop_duplicates(subset=['Country'])
+        latest_data_by_country = storage_data.country_snapshot(selection_latest())
 
         st.subheader("Current Fill Percentage by Country")
-        fig_country_fill = px.bar(
-            latest_data_by_country.sort_values(by='full', ascending=False),
-            x='Country',
-            y='full',
-            title='Current Gas Storage Fill Percentage by Country',
-            labels={'full': 'Fill Percentage (%)'},
-            color='full',
-            color_continuous_scale=px.colors.sequential.Viridis
-        )
-        st.plotly_chart(fig_country_fill, use_container_width=True)
+
+        def build_country_fill():
+            fig_country_fill = px.bar(
+                latest_data_by_country.sort_values(by='full', ascending=False),
+                x='Country',
+                y='full',
+                title='Current Gas Storage Fill Percentage by Country',
+                labels={'full': 'Fill Percentage (%)'},
+                color='full',
+                color_continuous_scale=px.colors.sequential.Viridis
+            )
+            return fig_country_fill
+
+        st.plotly_chart(cached_figure('country_fill', build_country_fill), use_container_width=True)
 
         st.subheader("Gas in Storage by Country (Latest Data)")
-        fig_country_gas = px.bar(
-            latest_data_by_country.sort_values(by='gasInStorage', ascending=False),
-            x='Country',
-            y='gasInStorage',
-            title='Gas in Storage by Country (Latest Available Data)',
-            labels={'gasInStorage': 'Gas in Storage (MCM)'},
-            color='gasInStorage',
-            color_continuous_scale=px.colors.sequential.Plasma
-        )
-        st.plotly_chart(fig_country_gas, use_container_width=True)
+
+        def build_country_gas():
+            fig_country_gas = px.bar(
+                latest_data_by_country.sort_values(by='gasInStorage', ascending=False),
+                x='Country',
+                y='gasInStorage',
+                title='Gas in Storage by Country (Latest Available Data)',
+                labels={'gasInStorage': 'Gas in Storage (MCM)'},
+                color='gasInStorage',
+                color_continuous_scale=px.colors.sequential.Plasma
+            )
+            return fig_country_gas
+
+        st.plotly_chart(cached_figure('country_gas', build_country_gas), use_container_width=True)
 
         st.subheader("Working Gas Volume by Country")
-        fig_country_working = px.bar(
-            latest_data_by_country.sort_values(by='workingGasVolume', ascending=False),
-            x='Country',
-            y='workingGasVolume',
-            title='Working Gas Volume by Country',
-            labels={'workingGasVolume': 'Working Gas Volume (MCM)'},
-            color='workingGasVolume',
-            color_continuous_scale=px.colors.sequential.Cividis
-        )
-        st.plotly_chart(fig_country_working, use_container_width=True)
+
+        def build_country_working():
+            fig_country_working = px.bar(
+                latest_data_by_country.sort_values(by='workingGasVolume', ascending=False),
+                x='Country',
+                y='workingGasVolume',
+                title='Working Gas Volume by Country',
+                labels={'workingGasVolume': 'Working Gas Volume (MCM)'},
+                color='workingGasVolume',
+                color_continuous_scale=px.colors.sequential.Cividis
+            )
+            return fig_country_working
+
+        st.plotly_chart(cached_figure('country_working', build_country_working), use_container_width=True)
 
     else:
         st.warning("No data available for country-level comparison with the selected filters.")
 
-with tab4:
+elif active_tab == TABS[3]:
     st.header("Facility Details")
 
     if not filtered_df_facility.empty:
@@ -317,7 +456,8 @@ with tab4:
         else:
             for facility_name in selected_facilities:
                 st.subheader(f"Details for: {facility_name}")
-                facility_data = filtered_df_facility[filtered_df_facility['Name'] == facility_name].sort_values(by='Date')
+                # Rows are already sorted by Date
+                facility_data = storage_data.filter_by_category(filtered_df_facility, 'Name', [facility_name])
 
                 if not facility_data.empty:
                     # Display key information for the facility
@@ -330,36 +470,48 @@ with tab4:
                     st.write(f"**Max Withdrawal Capacity:** {latest_facility_info['withdrawalCapacity']:,.2f} MCM/day")
 
                     # Plot historical fill percentage for the facility
-                    fig_facility_fill = px.line(
-                        facility_data,
-                        x='Date',
-                        y='full',
-                        title=f'Fill Percentage Trend for {facility_name}',
-                        labels={'full': 'Fill Percentage (%)'}
-                    )
-                    st.plotly_chart(fig_facility_fill, use_container_width=True)
+                    def build_facility_fill():
+                        fig_facility_fill = px.line(
+                            chart_series(facility_data, 'full'),
+                            x='Date',
+                            y='full',
+                            title=f'Fill Percentage Trend for {facility_name}',
+                            labels={'full': 'Fill Percentage (%)'}
+                        )
+                        return fig_facility_fill
+
+                    st.plotly_chart(cached_figure('facility_fill', build_facility_fill, facility_name), use_container_width=True)
 
                     # Plot historical gas in storage for the facility
-                    fig_facility_gas = px.line(
-                        facility_data,
-                        x='Date',
-                        y='gasInStorage',
-                        title=f'Gas in Storage Trend for {facility_name}',
-                        labels={'gasInStorage': 'Gas in Storage (MCM)'}
-                    )
-                    st.plotly_chart(fig_facility_gas, use_container_width=True)
+                    def build_facility_gas():
+                        fig_facility_gas = px.line(
+                            chart_series(facility_data, 'gasInStorage'),
+                            x='Date',
+                            y='gasInStorage',
+                            title=f'Gas in Storage Trend for {facility_name}',
+                            labels={'gasInStorage': 'Gas in Storage (MCM)'}
+                        )
+                        return fig_facility_gas
+
+                    st.plotly_chart(cached_figure('facility_gas', build_facility_gas, facility_name), use_container_width=True)
 
                     # Plot historical injection/withdrawal for the facility
-                    fig_facility_io = go.Figure()
-                    fig_facility_io.add_trace(go.Scatter(x=facility_data['Date'], y=facility_data['injection'], mode='lines', name='Injection'))
-                    fig_facility_io.add_trace(go.Scatter(x=facility_data['Date'], y=facility_data['withdrawal'], mode='lines', name='Withdrawal'))
-                    fig_facility_io.update_layout(
-                        title=f'Daily Injection/Withdrawal for {facility_name}',
-                        xaxis_title='Date',
-                        yaxis_title='Volume (MCM/day)',
-                        hovermode="x unified"
-                    )
-                    st.plotly_chart(fig_facility_io, use_container_width=True)
+                    def build_facility_io():
+                        facility_injection = chart_series(facility_data, 'injection', method='minmax')
+                        facility_withdrawal = chart_series(facility_data, 'withdrawal', method='minmax')
+
+                        fig_facility_io = go.Figure()
+                        fig_facility_io.add_trace(go.Scatter(x=facility_injection['Date'], y=facility_injection['injection'], mode='lines', name='Injection'))
+                        fig_facility_io.add_trace(go.Scatter(x=facility_withdrawal['Date'], y=facility_withdrawal['withdrawal'], mode='lines', name='Withdrawal'))
+                        fig_facility_io.update_layout(
+                            title=f'Daily Injection/Withdrawal for {facility_name}',
+                            xaxis_title='Date',
+                            yaxis_title='Volume (MCM/day)',
+                            hovermode="x unified"
+                        )
+                        return fig_facility_io
+
+                    st.plotly_chart(cached_figure('facility_io', build_facility_io, facility_name), use_container_width=True)
 
                     st.markdown("---") # Separator for multiple facilities
                 else:
@@ -369,3 +521,9 @@ with tab4:
 
 st.markdown("---")
 st.markdown("Data Source: Storage.csv")
+
+cache_stats = figure_cache.stats()
+st.sidebar.caption(
+    f"Chart cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+    f"{cache_stats['entries']} figures ({cache_stats['bytes'] / 1024 ** 2:.1f} MB)"
+)
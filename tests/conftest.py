@@ -0,0 +1,21 @@
+"""Fixtures shared by the SQL tests, which run against SQLite."""
+
+import pytest
+import sqlalchemy
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """SQLite engine that commits every statement on its own, like the SQLConnection engines, unless the
+    connection is switched to a transactional isolation level."""
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'test.db'}", isolation_level="AUTOCOMMIT")
+
+    @sqlalchemy.event.listens_for(engine, "begin")
+    def begin(conn):
+        # pysqlite only begins a transaction before DML, so releasing a leading savepoint would commit.
+        # Transactions are begun explicitly, like SQL Server does, unless the connection is in autocommit mode
+        if conn.connection.dbapi_connection.isolation_level is not None:
+            conn.exec_driver_sql("BEGIN")
+
+    yield engine
+    engine.dispose()
@@ -0,0 +1,57 @@
+"""Tests for Modules.resqlconnection.arrow_fetch, against SQLite."""
+
+import pyarrow as pa
+import pytest
+import sqlalchemy
+
+# The package imports the SQL Server driver
+pytest.importorskip("pyodbc")
+
+from Modules.resqlconnection import arrow_fetch  # noqa: E402
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE prices (Id INTEGER, Area TEXT, Price REAL, Note TEXT)")
+        conn.exec_driver_sql(
+            "INSERT INTO prices VALUES (1, 'NO1', 10.5, NULL), (2, 'NO2', NULL, NULL), (3, 'NO1', 12, 'late')",
+        )
+    yield engine
+    engine.dispose()
+
+
+def test_declared_schema_is_used(engine):
+    schema = pa.schema([("Id", pa.int32()), ("Area", pa.string()), ("Price", pa.float64()), ("Note", pa.string())])
+    table = arrow_fetch.fetch_arrow(engine, "SELECT * FROM prices ORDER BY Id", schema=schema, batch_size=2)
+    assert table.schema == schema
+    assert table.column("Price").to_pylist() == [10.5, None, 12.0]
+
+
+def test_schema_is_inferred_without_driver_types(engine):
+    # SQLite reports no column types in the cursor description
+    table = arrow_fetch.fetch_arrow(engine, "SELECT Id, Area, Price FROM prices ORDER BY Id")
+    assert table.schema == pa.schema([("Id", pa.int64()), ("Area", pa.string()), ("Price", pa.float64())])
+    assert table.column("Area").to_pylist() == ["NO1", "NO2", "NO1"]
+
+
+def test_column_that_is_null_in_the_first_batch(engine):
+    table = arrow_fetch.fetch_arrow(engine, "SELECT Id, Note, Price FROM prices ORDER BY Id", batch_size=2)
+    assert table.schema.field("Note").type == pa.string()
+    assert table.column("Note").to_pylist() == [None, None, "late"]
+    assert table.column("Price").to_pylist() == [10.5, None, 12.0]
+
+
+def test_empty_result(engine):
+    table = arrow_fetch.fetch_arrow(engine, "SELECT Id, Area FROM prices WHERE Id > 10")
+    assert table.num_rows == 0
+    assert table.column_names == ["Id", "Area"]
+
+
+def test_arrow_to_df(engine):
+    table = arrow_fetch.fetch_arrow(engine, "SELECT Id, Area FROM prices ORDER BY Id")
+    df = arrow_fetch.arrow_to_df(table)
+    assert df["Area"].tolist() == ["NO1", "NO2", "NO1"]
+    assert str(df["Id"].dtype) == "int64[pyarrow]"
+    assert str(arrow_fetch.arrow_to_df(table, arrow_dtypes=False)["Id"].dtype) == "int64"
@@ -0,0 +1,170 @@
+"""Tests for Modules.resqlconnection.bulk_loader, against SQLite."""
+
+import pandas as pd
+import pytest
+import sqlalchemy
+
+# The package imports the SQL Server driver
+pytest.importorskip("pyodbc")
+
+from Modules.resqlconnection import bulk_loader  # noqa: E402
+
+
+def frame(rows):
+    return pd.DataFrame({"Id": range(rows), "Value": [i * 0.5 for i in range(rows)]})
+
+
+def count_rows(bind, table):
+    if isinstance(bind, sqlalchemy.engine.Connection):
+        return bind.exec_driver_sql(f"SELECT COUNT(*) FROM {table}").scalar()
+    with bind.connect() as conn:
+        return conn.exec_driver_sql(f"SELECT COUNT(*) FROM {table}").scalar()
+
+
+class FailingLoader:
+    """Writes half of the frame, then fails like a loader losing its connection halfway."""
+
+    name = "failing"
+
+    def supports(self, engine):
+        return True
+
+    def max_batch_rows(self, df, engine):
+        return None
+
+    def load(self, df, table_name, schema, engine, batch_size):
+        with bulk_loader.transaction(engine) as conn:
+            df.head(len(df.index) // 2).to_sql(table_name, con=conn, schema=schema, if_exists="append", index=False)
+            raise RuntimeError("connection lost")
+
+
+def test_failed_loader_rolls_back_on_autocommit_engine(engine):
+    df = frame(100)
+    report = bulk_loader.bulk_load(df, "target", None, engine, loaders=[FailingLoader(), bulk_loader.ToSqlLoader()])
+    assert report["loader"] == "to_sql"
+    assert count_rows(engine, "target") == 100
+
+
+def test_failed_loader_rolls_back_to_its_savepoint(engine):
+    df = frame(100)
+    with bulk_loader.connect(engine) as conn:
+        with conn.begin():
+            loaders = [FailingLoader(), bulk_loader.ToSqlLoader()]
+            report = bulk_loader.bulk_load(df, "stage", None, conn, loaders=loaders)
+            assert report["loader"] == "to_sql"
+            assert count_rows(conn, "stage") == 100
+    assert count_rows(engine, "stage") == 100
+
+
+def test_failed_transaction_leaves_no_rows(engine):
+    frame(0).to_sql("stage", con=engine, index=False)
+    with pytest.raises(RuntimeError, match="merge failed"):
+        with bulk_loader.connect(engine) as conn:
+            with conn.begin():
+                bulk_loader.bulk_load(frame(100), "stage", None, conn, loaders=[bulk_loader.ToSqlLoader()])
+                raise RuntimeError("merge failed")
+    assert count_rows(engine, "stage") == 0
+
+
+class RecordingLoader:
+    """Appends with to_sql and records the batch size it was given."""
+
+    name = "recording"
+
+    def __init__(self, supported=True, max_rows=None):
+        self.supported = supported
+        self.max_rows = max_rows
+        self.batch_sizes = []
+
+    def supports(self, engine):
+        return self.supported
+
+    def max_batch_rows(self, df, engine):
+        return self.max_rows
+
+    def load(self, df, table_name, schema, engine, batch_size):
+        self.batch_sizes.append(batch_size)
+        with bulk_loader.transaction(engine) as conn:
+            df.to_sql(table_name, con=conn, schema=schema, if_exists="append", index=False)
+        return len(df.index)
+
+
+def test_unsupported_loaders_are_skipped(engine):
+    skipped = RecordingLoader(supported=False)
+    used = RecordingLoader()
+    report = bulk_loader.bulk_load(frame(10), "target", None, engine, loaders=[skipped, used])
+    assert report["rows"] == 10
+    assert skipped.batch_sizes == []
+    assert used.batch_sizes == [bulk_loader.DEFAULT_BATCH_SIZE]
+
+
+def test_every_loader_failing_raises(engine):
+    with pytest.raises(RuntimeError, match="Every loader failed"):
+        bulk_loader.bulk_load(frame(10), "target", None, engine, loaders=[FailingLoader(), FailingLoader()])
+    assert count_rows(engine, "target") == 0
+
+
+def test_batch_size_is_capped_by_the_loader_and_memory(engine):
+    capped = RecordingLoader(max_rows=300)
+    bulk_loader.bulk_load(frame(1000), "target", None, engine, loaders=[capped])
+    assert capped.batch_sizes == [300]
+
+    # Two columns of 8 bytes, so 1600 bytes hold 100 rows
+    limited = RecordingLoader()
+    bulk_loader.bulk_load(frame(1000), "target", None, engine, loaders=[limited], memory_bytes=1600)
+    assert limited.batch_sizes == [100]
+
+
+def test_only_the_multi_row_insert_on_sql_server_is_bound_by_the_parameter_limit():
+    mssql = sqlalchemy.create_mock_engine("mssql://", executor=None)
+    df = frame(10)
+    assert bulk_loader.ToSqlLoader(method="multi").max_batch_rows(df, mssql) == bulk_loader.MSSQL_MAX_PARAMETERS // 2 - 1
+    assert bulk_loader.ToSqlLoader().max_batch_rows(df, mssql) is None
+    assert bulk_loader.ExecutemanyLoader().max_batch_rows(df, mssql) is None
+
+
+def test_to_sql_loader_makes_one_call(engine, monkeypatch):
+    calls = []
+    to_sql = pd.DataFrame.to_sql
+
+    def counting_to_sql(self, *args, **kwargs):
+        calls.append(kwargs.get("chunksize"))
+        return to_sql(self, *args, **kwargs)
+
+    frame(0).to_sql("target", con=engine, index=False)
+    monkeypatch.setattr(pd.DataFrame, "to_sql", counting_to_sql)
+    bulk_loader.bulk_load(frame(1000), "target", None, engine, loaders=[bulk_loader.ToSqlLoader()], batch_size=300)
+    assert calls == [300]
+    assert count_rows(engine, "target") == 1000
+
+
+def test_executemany_loader(engine):
+    frame(0).to_sql("target", con=engine, index=False)
+    report = bulk_loader.bulk_load(frame(1000), "target", None, engine, loaders=[bulk_loader.ExecutemanyLoader()])
+    assert report["loader"] == "executemany"
+    assert count_rows(engine, "target") == 1000
+
+
+def test_iter_batches_covers_every_row():
+    batches = list(bulk_loader.iter_batches(frame(250), 100))
+    assert [len(batch.index) for batch in batches] == [100, 100, 50]
+
+
+def test_adaptive_sizer_stays_within_its_bounds():
+    sizer = bulk_loader.AdaptiveBatchSizer(1000, min_size=100, max_size=8000)
+    for _ in range(30):
+        size = sizer.next_size()
+        assert 100 <= size <= 8000
+        # Rows per second peak at 4000 rows per batch
+        rows_per_second = min(size, 4000) * 1000 - max(size - 4000, 0) * 100
+        sizer.record(size, size / rows_per_second)
+    assert sizer.settled
+    assert sizer.report()["chosen_batch_size"] == 4000
+
+
+def test_adaptive_upload_prints_its_chosen_batch_size(engine, capsys):
+    report = bulk_loader.bulk_load(
+        frame(1000), "target", None, engine, loaders=[bulk_loader.ToSqlLoader()], batch_size=100, adaptive=True
+    )
+    assert count_rows(engine, "target") == 1000
+    assert f"chose {report['chosen_batch_size']} rows per batch" in capsys.readouterr().out
@@ -0,0 +1,66 @@
+"""Tests for Modules.frame_diff against the merge it replaces in SqlCompareTools."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Modules import frame_diff
+
+KEYS = ["Country", "Sector", "Date"]
+
+
+def merge_diff(df_new, df_old, key_columns):
+    """The previous compare_and_upload: left merge on the keys, compare the values at 3 decimals."""
+    df_final = pd.merge(df_new, df_old, on=key_columns, how="left")
+    return df_final.loc[
+        df_final["Value"].astype(float).round(3) != df_final["old_Value"].astype(float).round(3)
+    ].reset_index(drop=True)
+
+
+def stored_and_crawled(seed, rows=2000):
+    rng = np.random.default_rng(seed)
+    df_old = pd.DataFrame(
+        {
+            "Country": rng.choice(["NO", "DE", "FR", None], rows),
+            "Sector": rng.choice(["Power", "Industry", "Households"], rows),
+            "Date": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 400, rows), unit="D"),
+            "old_Value": rng.normal(100, 20, rows).round(4),
+        },
+    ).drop_duplicates(KEYS)
+    df_new = df_old.rename(columns={"old_Value": "Value"}).sample(frac=0.8, random_state=seed)
+    # A fifth of the values moves, some of them by less than the compared precision
+    moved = rng.random(len(df_new)) < 0.2
+    df_new["Value"] = np.where(moved, df_new["Value"] + rng.choice([1e-4, 0.01, 5], len(df_new)), df_new["Value"])
+    df_new.loc[df_new.sample(frac=0.02, random_state=seed).index, "Value"] = np.nan
+    unseen = df_new.head(50).assign(Date=pd.Timestamp("2030-01-01"))
+    return pd.concat([df_new, unseen], ignore_index=True), df_old.reset_index(drop=True)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_changed_rows_matches_merge(seed):
+    df_new, df_old = stored_and_crawled(seed)
+    expected = merge_diff(df_new, df_old, KEYS)
+    result = frame_diff.changed_rows(df_new, df_old, KEYS)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_classify_rows():
+    df_old = pd.DataFrame({"Country": ["NO", "DE", "FR"], "old_Value": [1.0, 2.0, np.nan]})
+    df_new = pd.DataFrame({"Country": ["NO", "DE", "FR", "SE"], "Value": [1.0004, 2.01, np.nan, 4.0]})
+    status, old_values = frame_diff.classify_rows(df_new, df_old, ["Country"])
+    assert status.tolist() == [frame_diff.UNCHANGED, frame_diff.CHANGED, frame_diff.CHANGED, frame_diff.NEW]
+    np.testing.assert_array_equal(old_values, [1.0, 2.0, np.nan, np.nan])
+
+
+def test_duplicated_old_keys_match_their_first_row():
+    df_old = pd.DataFrame({"Country": ["NO", "NO"], "old_Value": [1.0, 2.0]})
+    df_new = pd.DataFrame({"Country": ["NO"], "Value": [1.0]})
+    status, _ = frame_diff.classify_rows(df_new, df_old, ["Country"])
+    assert status.tolist() == [frame_diff.UNCHANGED]
+
+
+def test_keys_of_different_dtypes_are_matched():
+    df_old = pd.DataFrame({"Id": [1.0, 2.0], "old_Value": [1.0, 2.0]})
+    df_new = pd.DataFrame({"Id": [1, 2, 3], "Value": [1.0, 3.0, 3.0]})
+    status, _ = frame_diff.classify_rows(df_new, df_old, ["Id"])
+    assert status.tolist() == [frame_diff.UNCHANGED, frame_diff.CHANGED, frame_diff.NEW]
@@ -0,0 +1,125 @@
+"""Tests for Modules.resqlconnection.monitoring, against SQLite."""
+
+import sqlite3
+import threading
+
+import pandas as pd
+import pytest
+import sqlalchemy
+
+# The package imports the SQL Server driver
+pytest.importorskip("pyodbc")
+
+from Modules.resqlconnection import monitoring  # noqa: E402
+
+
+@pytest.fixture
+def info_engine(tmp_path):
+    """SQLite engine with an attached Info database standing in for the Info schema."""
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'main.db'}")
+
+    @sqlalchemy.event.listens_for(engine, "connect")
+    def attach(dbapi_connection, connection_record):
+        dbapi_connection.execute(f"ATTACH DATABASE '{tmp_path / 'info.db'}' AS Info")
+
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def sink(info_engine, tmp_path):
+    sink = monitoring.MonitoringSink(info_engine, fallback_path=str(tmp_path / "fallback" / "monitoring.db"))
+    sink.schema_checked = True
+    return sink
+
+
+def monitored_rows(engine):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql(f"SELECT COUNT(*) FROM Info.{monitoring.MONITORING_TABLE}").scalar()
+
+
+def fallback_rows(sink):
+    conn = sqlite3.connect(sink.fallback_path)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM [{monitoring.MONITORING_TABLE}]").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def unreachable(df):
+    raise ConnectionError("database unreachable")
+
+
+def test_records_survive_an_unreachable_database(sink, info_engine, monkeypatch):
+    monkeypatch.setattr(sink, "_write", unreachable)
+    sink.record("dbo", "a", 1, True)
+    sink.record("dbo", "b", 2, True)
+    assert sink.flush() == 0
+    assert fallback_rows(sink) == 2
+
+    monkeypatch.undo()
+    sink.record("dbo", "c", 3, False)
+    assert sink.flush() == 3
+    assert monitored_rows(info_engine) == 3
+    assert fallback_rows(sink) == 0
+
+
+def test_records_appended_during_a_flush_are_kept(sink, info_engine, monkeypatch):
+    monkeypatch.setattr(sink, "_write", unreachable)
+    sink.record("dbo", "a", 1, True)
+    sink.flush()
+    monkeypatch.undo()
+
+    read_fallback = sink._read_fallback
+
+    def read_then_append():
+        # Another process appends a record after this flush has read the file
+        pending = read_fallback()
+        other = monitoring.MonitoringSink(sink.engine, fallback_path=sink.fallback_path)
+        other.record("dbo", "other", 5, True)
+        other._write_fallback(pd.DataFrame(other._records, columns=monitoring.MONITORING_COLUMNS))
+        return pending
+
+    monkeypatch.setattr(sink, "_read_fallback", read_then_append)
+    assert sink.flush() == 1
+    assert monitored_rows(info_engine) == 1
+    assert fallback_rows(sink) == 1
+
+
+def test_records_stay_in_memory_when_the_fallback_fails(sink, tmp_path, monkeypatch):
+    blocker = tmp_path / "blocker"
+    blocker.write_text("")
+    sink.fallback_path = str(blocker / "monitoring.db")
+    monkeypatch.setattr(sink, "_write", unreachable)
+    sink.record("dbo", "a", 1, True)
+    assert sink.flush() == 0
+    assert len(sink._records) == 1
+
+
+def test_background_thread_survives_a_failing_flush(sink):
+    calls = []
+    done = threading.Event()
+
+    def failing_flush():
+        calls.append(1)
+        if len(calls) >= 3:
+            done.set()
+        raise RuntimeError("flush failed")
+
+    sink.flush_interval = 0.01
+    sink.flush = failing_flush
+    sink.record("dbo", "a", 1, True)
+    assert done.wait(5)
+    assert sink._thread.is_alive()
+    sink._stopped.set()
+    sink._wake.set()
+    sink._thread.join(5)
+
+
+def test_fallback_file_per_database():
+    first = sqlalchemy.create_engine("sqlite:///first.db")
+    second = sqlalchemy.create_engine("sqlite:///second.db")
+    assert monitoring.default_fallback_path(first) != monitoring.default_fallback_path(second)
+    assert monitoring.default_fallback_path(first) == monitoring.default_fallback_path(
+        sqlalchemy.create_engine("sqlite:///first.db")
+    )
@@ -0,0 +1,102 @@
+"""Tests for Method.staged_merge, against SQLite."""
+
+import pandas as pd
+import pytest
+
+# The package imports the SQL Server driver
+pytest.importorskip("pyodbc")
+
+from Modules.resqlconnection.methods import Method  # noqa: E402
+from Modules.resqlconnection.sql_connection import SQLConnection  # noqa: E402
+
+KEYS = ["Area", "Date"]
+
+
+@pytest.fixture
+def sql_conn(engine):
+    # Without the ODBC connection SQLConnection opens in __init__
+    sql_conn = SQLConnection.__new__(SQLConnection)
+    sql_conn.engine = engine
+    sql_conn.server_name = "local"
+    sql_conn.db_name = "main"
+    return sql_conn
+
+
+@pytest.fixture
+def method():
+    method = Method(255)
+
+    def get_table_columns(table_name, schema_name, sql_conn, refresh=False):
+        # SQLite has no INFORMATION_SCHEMA
+        with sql_conn.engine.connect() as conn:
+            rows = conn.exec_driver_sql(f"PRAGMA {schema_name}.table_info([{table_name}])").fetchall()
+        return pd.DataFrame([(row[1], row[2]) for row in rows], columns=["COLUMN_NAME", "DATA_TYPE"])
+
+    method.get_table_columns = get_table_columns
+    return method
+
+
+def crawl(rows, day):
+    df = pd.DataFrame(rows, columns=["Area", "Date", "Value"])
+    return df.assign(CrawlDate=pd.Timestamp("2025-01-01") + pd.Timedelta(days=day))
+
+
+def read_table(engine):
+    df = pd.read_sql("SELECT * FROM Prices", engine)
+    # SQLite keeps timestamps as text, written with or without microseconds depending on the loader
+    df["CrawlDate"] = pd.to_datetime(df["CrawlDate"], format="ISO8601")
+    return df.sort_values(KEYS).reset_index(drop=True)
+
+
+def append_and_remove_duplicates(old, new, replace):
+    """What remove_duplicates leaves after appending `new` to the table: one row per key, the latest crawl
+    if `replace`, the earliest otherwise."""
+    df = pd.concat([old, new], ignore_index=True).sort_values("CrawlDate", kind="stable")
+    df = df.drop_duplicates(KEYS, keep="last" if replace else "first")
+    return df.sort_values(KEYS).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("replace", [True, False])
+def test_staged_merge_matches_append_and_remove_duplicates(engine, sql_conn, method, replace):
+    old = pd.concat(
+        [
+            crawl([["NO1", "2025-01-01", 10.0], ["NO2", "2025-01-01", 20.0], ["NO3", "2025-01-01", 30.0]], 0),
+            # Already duplicated in a partition of the push
+            crawl([["NO2", "2025-01-01", 21.0]], 1),
+        ],
+        ignore_index=True,
+    )
+    old.to_sql("Prices", engine, index=False)
+    new = pd.concat(
+        [
+            # A new value for an existing key, and a key that is not in the table
+            crawl([["NO1", "2025-01-01", 11.0], ["NO2", "2025-01-01", 22.0], ["NO4", "2025-01-01", 40.0]], 2),
+            # Duplicated within the push
+            crawl([["NO4", "2025-01-01", 41.0]], 3),
+        ],
+        ignore_index=True,
+    )
+
+    report = method.staged_merge("Prices", "main", new, ["Value"], replace, sql_conn)
+
+    expected = append_and_remove_duplicates(old, new, replace)
+    pd.testing.assert_frame_equal(read_table(engine), expected)
+    assert report["inserted"] - report["deleted"] == len(expected) - len(old)
+    with engine.connect() as conn:
+        tables = conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'").scalars().all()
+    assert tables == ["Prices"]
+
+
+def test_failed_merge_changes_nothing_and_drops_the_stage(engine, sql_conn, method):
+    old = crawl([["NO1", "2025-01-01", 10.0]], 0)
+    old.to_sql("Prices", engine, index=False)
+    new = crawl([["NO1", "2025-01-01", 11.0], ["NO2", "2025-01-01", 20.0]], 1)
+
+    # The push references a column the table does not have, so the insert into the table fails
+    with pytest.raises(Exception):
+        method.staged_merge("Prices", "main", new.assign(Unknown=1), ["Value"], True, sql_conn)
+
+    pd.testing.assert_frame_equal(read_table(engine), old)
+    with engine.connect() as conn:
+        tables = conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'").scalars().all()
+    assert tables == ["Prices"]
@@ -0,0 +1,75 @@
+"""Tests for the incremental ingestion of Modules.storage_data.StorageStore."""
+
+import pandas as pd
+import pytest
+
+from Modules import storage_data
+
+HEADER = (
+    "status,gasInStorage,full,trend,injection,withdrawal,workingGasVolume,injectionCapacity,"
+    "withdrawalCapacity,Name,Country,Type,operator,Year,Month,Day,Date,Week,LastUpdateTime"
+)
+
+
+def storage_line(name, country, day, full=50.0):
+    return (
+        f"C,1.5,{full},0,1,0,3.0,10,12,{name},{country},DSR,Operator,2025,7,{day},7/{day}/2025,27,7/{day + 1}/2025"
+    )
+
+
+@pytest.fixture
+def storage_csv(tmp_path):
+    path = tmp_path / "Storage.csv"
+    lines = [
+        HEADER,
+        storage_line("UGS Damborice", "Czechia", 1),
+        storage_line("UGS Holford", "United Kingdom", 1),
+        storage_line("UGS Damborice", "Czechia", 2),
+        storage_line("UGS Holford", "United Kingdom", 2),
+    ]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return path
+
+
+def append_lines(path, *lines):
+    with open(path, "a", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+
+
+def assert_matches_full_load(store, path):
+    df, cube, latest, _ = store.snapshot()
+    expected = storage_data.StorageStore(str(path), use_cache=False)
+    pd.testing.assert_frame_equal(df, expected.df, check_categorical=False)
+    pd.testing.assert_frame_equal(
+        latest.sort_values(["Name", "Date"]).reset_index(drop=True),
+        expected.latest.sort_values(["Name", "Date"]).reset_index(drop=True),
+        check_categorical=False,
+    )
+    pd.testing.assert_frame_equal(cube, expected.cube, check_categorical=False)
+
+
+@pytest.mark.parametrize(
+    "lines",
+    [
+        # Only facilities that are already known
+        [storage_line("UGS Damborice", "Czechia", 3, full=55.0)],
+        # A facility of a new country
+        [storage_line("UGS Damborice", "Czechia", 3), storage_line("UGS Rehden", "Germany", 3)],
+    ],
+)
+def test_refresh_after_append_keeps_categoricals(storage_csv, lines):
+    store = storage_data.StorageStore(str(storage_csv), use_cache=False)
+    append_lines(storage_csv, *lines)
+
+    assert store.refresh() == len(lines)
+
+    df, cube, latest, _ = store.snapshot()
+    for frame in (df, latest):
+        assert isinstance(frame["Name"].dtype, pd.CategoricalDtype)
+        assert isinstance(frame["Country"].dtype, pd.CategoricalDtype)
+    assert isinstance(cube.index.levels[cube.index.names.index("Country")].dtype, pd.CategoricalDtype)
+
+    # What the dashboard does for the full date range in shared mode
+    filtered = storage_data.filter_by_category(latest, "Country", ["Czechia"])
+    assert filtered["Date"].max() == pd.Timestamp("2025-07-03")
+    assert_matches_full_load(store, storage_csv)